@@ -1,26 +1,115 @@
-import asyncio
-import os
 import time
+STARTUP_T0 = time.perf_counter()
+
+import os
 import json
 import re
-from telethon.sync import TelegramClient
-from telethon import errors, functions, types
+import heapq
+import datetime
+import hashlib
+import sqlite3
+import uuid
+import sys
+import argparse
+import contextlib
+import importlib
+
+__version__ = "1.1.0"
+
+class LazyImport:
+    """
+    Stands in for a module, a module attribute or a factory result and imports it on first use,
+    so startup only pays for Telethon / Rich on the code paths that actually need them.
+    """
+    def __init__(self, module=None, attr=None, factory=None):
+        object.__setattr__(self, "_lazy_module", module)
+        object.__setattr__(self, "_lazy_attr", attr)
+        object.__setattr__(self, "_lazy_factory", factory)
+        object.__setattr__(self, "_lazy_obj", None)
+
+    def _load(self):
+        obj = self._lazy_obj
+        if obj is None:
+            if self._lazy_factory:
+                obj = self._lazy_factory()
+            else:
+                obj = importlib.import_module(self._lazy_module)
+                if self._lazy_attr:
+                    obj = getattr(obj, self._lazy_attr)
+            object.__setattr__(self, "_lazy_obj", obj)
+        return obj
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+# asyncio alone is most of the base import time; only network paths need it
+asyncio = LazyImport("asyncio")
+
+# --- Telethon (lazy) ---
+TelegramClient = LazyImport("telethon.sync", "TelegramClient")
+errors = LazyImport("telethon.errors")
+functions = LazyImport("telethon.tl.functions")
+types = LazyImport("telethon.tl.types")
+utils = LazyImport("telethon.utils")
+
+# --- Rich UI Imports (lazy) ---
+Panel = LazyImport("rich.panel", "Panel")
+Table = LazyImport("rich.table", "Table")
+Text = LazyImport("rich.text", "Text")
+Confirm = LazyImport("rich.prompt", "Confirm")
+Progress = LazyImport("rich.progress", "Progress")
+SpinnerColumn = LazyImport("rich.progress", "SpinnerColumn")
+TextColumn = LazyImport("rich.progress", "TextColumn")
+BarColumn = LazyImport("rich.progress", "BarColumn")
+TaskProgressColumn = LazyImport("rich.progress", "TaskProgressColumn")
+rprint = LazyImport("rich", "print")
+
+quiet_console = False  # Set by headless runs whose stdout is not a TTY
 
-# --- Rich UI Imports ---
-from rich.console import Console
-from rich.panel import Panel
-from rich.table import Table
-from rich.text import Text
-from rich.prompt import Confirm
-from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn
-from rich import print as rprint
+def _make_console():
+    from rich.console import Console
+    return Console(quiet=quiet_console)
 
-console = Console()
+console = LazyImport(factory=_make_console)
+
+def rich_console():
+    """The real Console behind `console`, for Rich objects (Progress, Live) that use it as a context manager."""
+    return console._load()
 
 # --- Storage Constants ---
 CREDENTIALS_FILE = "credentials.txt" # Legacy support
 ACCOUNTS_FILE = "accounts.json"
 TEMPLATE_FILE = "target_templates.json"
+PEER_CACHE_FILE = "peer_cache_{}.json"  # Per account, access hashes are account-bound
+DB_FILE = "moontele.db"
+PERMISSION_TTL = 10 * 60  # How long pre-flight chat permissions stay cached
+QUARANTINE_AFTER = 3  # Consecutive permanent failures before a target is quarantined
+DELIVERED = ("sent", "scheduled", "deleted")  # Journal statuses that resume must not send again
+METRICS_DIR = "metrics"  # One summary JSON per broadcast
+PROM_FILE = os.environ.get("MOONTELE_PROM_FILE")  # Optional Prometheus textfile, rewritten after each run
+ALBUM_MAX = 10  # Telegram's limit on items per media group
+DELETE_BATCH = 100  # Telegram's limit on message ids per delete request
+DIALOG_INDEX_TTL = 5 * 60  # The picker re-syncs the local chat list when it is older than this
+# How a link source is delivered: re-sent as a new message, forwarded with its
+# "Forwarded from" header, or forwarded server-side with the header dropped
+SEND_MODES = {
+    "copy": "Send as copy",
+    "forward": "Forward (shows 'Forwarded from')",
+    "quiet": "Copy without attribution (server-side, no re-upload)",
+    "upload": "Re-upload once (protected sources; media cached locally)",
+}
+MEDIA_CACHE_DIR = "media_cache"
+MEDIA_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Warm sessions kept open for account switching (override via environment)
+CLIENT_POOL_SIZE = int(os.environ.get("MOONTELE_POOL_SIZE", 3))
+CLIENT_IDLE_TIMEOUT = int(os.environ.get("MOONTELE_POOL_IDLE", 15 * 60))
+CRYPTO_BACKEND = os.environ.get("MOONTELE_CRYPTO")  # Force "cryptg", "openssl" or "pyaes" (default: fastest available)
 
 # --- UI Helpers ---
 
@@ -41,19 +130,384 @@ def print_banner():
 """, style="bold cyan")
     console.print(Panel(banner_text, border_style="blue", expand=False))
 
-# --- Core Logic ---
+# --- Peer Cache ---
 
-class TelegramForwarder:
-    def __init__(self, api_id, api_hash, phone_number):
-        self.api_id = api_id
-        self.api_hash = api_hash
+def peer_to_dict(entity):
+    """Serializes a Telethon entity into the fields needed to rebuild its InputPeer."""
+    peer = utils.get_input_peer(entity)
+    if isinstance(peer, types.InputPeerChannel):
+        kind, pid, access_hash = "channel", peer.channel_id, peer.access_hash
+    elif isinstance(peer, types.InputPeerChat):
+        kind, pid, access_hash = "chat", peer.chat_id, None
+    elif isinstance(peer, types.InputPeerUser):
+        kind, pid, access_hash = "user", peer.user_id, peer.access_hash
+    else:
+        return None
+    if hasattr(entity, 'first_name'):
+        title = f"{entity.first_name or ''} {entity.last_name or ''}".strip() or "Unknown"
+    else:
+        title = getattr(entity, 'title', None) or getattr(entity, 'username', None) or "Unknown"
+    return {
+        "type": kind,
+        "id": pid,
+        "access_hash": access_hash,
+        "title": title,
+        "username": getattr(entity, 'username', None),
+        "forum": bool(getattr(entity, 'forum', False)),
+    }
+
+def input_peer_from_dict(data):
+    """Builds an InputPeer from a dict produced by peer_to_dict (no network)."""
+    kind = data.get("type")
+    if kind == "channel" and data.get("access_hash") is not None:
+        return types.InputPeerChannel(data["id"], data["access_hash"])
+    if kind == "chat":
+        return types.InputPeerChat(data["id"])
+    if kind == "user" and data.get("access_hash") is not None:
+        return types.InputPeerUser(data["id"], data["access_hash"])
+    return None
+
+def marked_peer_id(data):
+    """Returns the -100 / negative marked id Telethon uses for the given peer dict."""
+    if data["type"] == "channel":
+        return int(f"-100{data['id']}")
+    if data["type"] == "chat":
+        return -data["id"]
+    return data["id"]
+
+def target_input_peer(target):
+    """InputPeer for a template entry from its stored peer_type/access_hash, or None for legacy entries."""
+    if not target.get("peer_type"):
+        return None
+    return input_peer_from_dict({"type": target["peer_type"], "id": target["chat_id"], "access_hash": target.get("access_hash")})
+
+def parse_target_link(link):
+    """
+    Parses a t.me message link into (chat, msg_id, topic_id).
+    chat is a username, or a -100 marked id for /c/ private links; msg_id / topic_id may be None.
+    Returns None if the link can't be parsed.
+    """
+    # Remove protocol and standard clean up
+    clean_link = link.strip().replace("https://", "").replace("http://", "").replace("t.me/", "")
+    parts = [p for p in clean_link.split("?")[0].split("/") if p]
+    try:
+        # Handle Private Link /c/
+        if parts and parts[0] == "c":
+            # format: c/CHAT_ID/MSG_ID or c/CHAT_ID/TOPIC_ID/MSG_ID
+            if len(parts) < 3: return None
+            chat = int(f"-100{parts[1]}") # Add -100 prefix for private supergroups
+            topic_id = int(parts[2]) if len(parts) == 4 else None
+            return chat, int(parts[-1]), topic_id
+        if not parts: return None
+        # format: username/MSG_ID or username/topic/MSG_ID (rare)
+        msg_id = int(parts[-1]) if len(parts) > 1 else None
+        topic_id = int(parts[1]) if len(parts) == 3 else None
+        return parts[0], msg_id, topic_id
+    except ValueError:
+        return None
+
+class PeerCache:
+    """
+    Persistent chat_id -> InputPeer cache so repeat runs skip entity resolution.
+    Entries expire `ttl` seconds after they were last used; the least recently used are evicted
+    above `max_entries`. Changes stay in memory until save(), which callers run once per operation.
+    """
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}  # str(marked_id) -> peer dict + last_seen
+        self.aliases = {}  # username / bare id -> str(marked_id)
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path): return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get("peers", {})
+        except: self.entries = {}
+        for key, entry in self.entries.items():
+            self._index(key, entry)
+
+    def _index(self, key, entry):
+        self.aliases[str(entry["id"])] = key
+        if entry.get("username"):
+            self.aliases[entry["username"].lower()] = key
+
+    def _unindex(self, key, entry):
+        for alias in (str(entry["id"]), (entry.get("username") or "").lower()):
+            if self.aliases.get(alias) == key:
+                del self.aliases[alias]
+
+    def _key(self, chat):
+        if isinstance(chat, str):
+            chat = chat.strip().lstrip("@")
+            if not chat.lstrip("-").isdigit():
+                return self.aliases.get(chat.lower())
+        chat = str(chat)
+        return chat if chat in self.entries else self.aliases.get(chat)
+
+    def save(self):
+        """Writes the cache to disk if anything changed since the last save."""
+        if not self.dirty: return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"peers": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def get(self, chat):
+        """Returns the cached peer dict for a chat id / username, counting hits and misses."""
+        key = self._key(chat)
+        entry = self.entries.get(key) if key else None
+        now = time.time()
+        if entry and now - entry.get("last_seen", 0) > self.ttl:
+            self.invalidate(key)
+            entry = None
+        if entry:
+            self.hits += 1
+            entry["last_seen"] = now
+            self.dirty = True
+        else:
+            self.misses += 1
+        return entry
+
+    def get_input_peer(self, chat):
+        entry = self.get(chat)
+        return input_peer_from_dict(entry) if entry else None
+
+    def put(self, entity):
+        """Stores a resolved entity (in memory until save()). Returns the stored entry."""
+        entry = peer_to_dict(entity)
+        if not entry: return None
+        entry["last_seen"] = time.time()
+        key = str(marked_peer_id(entry))
+        old = self.entries.get(key)
+        if old:
+            self._unindex(key, old)
+        self.entries[key] = entry
+        self._index(key, entry)
+        if len(self.entries) > self.max_entries:
+            self._evict()
+        self.dirty = True
+        return entry
+
+    def invalidate(self, chat):
+        key = self._key(chat)
+        entry = self.entries.pop(key, None) if key else None
+        if entry:
+            self._unindex(key, entry)
+            self.dirty = True
+
+    def _evict(self):
+        # Trim to 90% so a full cache sorts once per few hundred puts, not on every put
+        by_age = sorted(self.entries, key=lambda k: self.entries[k].get("last_seen", 0))
+        for key in by_age[:len(self.entries) - int(self.max_entries * 0.9)]:
+            self._unindex(key, self.entries.pop(key))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+# --- Forum Topics ---
+
+class TopicResolver:
+    """
+    Forum topic metadata (title, closed flag) fetched per chat with one
+    GetForumTopicsByIDRequest for all wanted topic ids, and cached per chat.
+    """
+    BATCH = 100
+
+    def __init__(self, client):
+        self.client = client
+        self.topics = {}  # chat_id -> {topic_id: {"title": str, "closed": bool, "deleted": bool}}
+
+    async def get_topics(self, peer, topic_ids):
+        """Returns {topic_id: meta or None} for a peer dict, only asking Telegram for unknown ids."""
+        known = self.topics.setdefault(peer["id"], {})
+        missing = sorted({tid for tid in topic_ids if tid and tid not in known})
+        input_peer = input_peer_from_dict(peer)
+        for i in range(0, len(missing), self.BATCH):
+            chunk = missing[i:i + self.BATCH]
+            result = await self.client(functions.messages.GetForumTopicsByIDRequest(peer=input_peer, topics=chunk))
+            for topic in result.topics:
+                if isinstance(topic, types.ForumTopicDeleted):
+                    known[topic.id] = {"title": None, "closed": True, "deleted": True}
+                else:
+                    known[topic.id] = {"title": topic.title, "closed": bool(topic.closed), "deleted": False}
+        return {tid: known.get(tid) for tid in topic_ids}
+
+    async def titles(self, peer, topic_ids):
+        """{topic_id: title}, falling back to "Topic N" when the chat isn't a forum or the lookup fails."""
+        try:
+            metas = await self.get_topics(peer, topic_ids)
+        except Exception:
+            metas = {}
+        return {tid: (metas.get(tid) or {}).get("title") or f"Topic {tid}" for tid in topic_ids}
+
+# --- Media Cache ---
+
+def media_key(message):
+    """Stable id of a message's photo/document, or None if it has no downloadable media."""
+    media = getattr(message, 'media', None)
+    if isinstance(media, types.MessageMediaPhoto) and media.photo:
+        return f"photo-{media.photo.id}"
+    if isinstance(media, types.MessageMediaDocument) and media.document:
+        return f"document-{media.document.id}"
+    return None
+
+class MediaCache:
+    """
+    Content-addressed store of downloaded media: files are named by their sha256 and an index
+    maps media keys to them. Least recently used files are evicted above `max_bytes`.
+    """
+    def __init__(self, directory=MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        except: self.index = {}
+
+    def save(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, key):
+        """Path of the cached file for a media key (marked as recently used), or None."""
+        digest = self.index.get(key)
+        path = os.path.join(self.directory, digest) if digest else None
+        if not path or not os.path.exists(path):
+            return None
+        os.utime(path)
+        return path
+
+    async def download(self, client, message, key):
+        """Streams the media to disk chunk by chunk, hashing as it goes. Returns (path, bytes)."""
+        sha, size = hashlib.sha256(), 0
+        tmp_path = os.path.join(self.directory, f"{key}.part")
+        with open(tmp_path, 'wb') as f:
+            async for chunk in client.iter_download(message.media):
+                sha.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        digest = sha.hexdigest()
+        path = os.path.join(self.directory, digest)
+        os.replace(tmp_path, path)  # Same content under another key lands on the same file
+        self.index[key] = digest
+        self._evict(keep=digest)
+        self.save()
+        return path, size
+
+    def _evict(self, keep=None):
+        files = [(e.stat().st_mtime, e.stat().st_size, e.name) for e in os.scandir(self.directory)
+                 if e.is_file() and e.name != "index.json" and not e.name.endswith((".tmp", ".part"))]
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes: break
+            if name == keep: continue
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+        live = {name for _, _, name in files if os.path.exists(os.path.join(self.directory, name))}
+        self.index = {k: v for k, v in self.index.items() if v in live}
+
+class MediaPipeline:
+    """
+    Re-upload path for sources that can't be forwarded: each media file is downloaded once
+    (through MediaCache), uploaded once per session, and the resulting InputMedia handle is
+    reused for every later target. Transfer counters are kept in `stats`.
+    """
+    def __init__(self, client, cache=None):
+        self.client = client
+        self.cache = cache or MediaCache()
+        self.handles = {}  # media key -> InputMediaPhoto / InputMediaDocument
+        self.stats = {"downloaded": 0, "uploaded": 0, "cache_hits": 0, "reused": 0}
+
+    async def input_media(self, message):
+        key = media_key(message)
+        if key in self.handles:
+            self.stats["reused"] += 1
+            return self.handles[key]
+        path = self.cache.get(key)
+        if path:
+            self.stats["cache_hits"] += 1
+        else:
+            path, size = await self.cache.download(self.client, message, key)
+            self.stats["downloaded"] += size
+        input_file = await self.client.upload_file(path)
+        self.stats["uploaded"] += os.path.getsize(path)
+        if isinstance(message.media, types.MessageMediaPhoto):
+            uploaded = types.InputMediaUploadedPhoto(file=input_file)
+        else:
+            doc = message.media.document
+            uploaded = types.InputMediaUploadedDocument(file=input_file, mime_type=doc.mime_type, attributes=doc.attributes)
+        # Register the upload once; the returned media is a permanent, reusable handle
+        registered = await self.client(functions.messages.UploadMediaRequest(peer=types.InputPeerSelf(), media=uploaded))
+        self.handles[key] = utils.get_input_media(registered)
+        return self.handles[key]
+
+    async def send(self, peer, message_object, topic_id=None, schedule=None):
+        messages = message_object if isinstance(message_object, list) else [message_object]
+        if not any(media_key(m) for m in messages):
+            return await self.client.send_message(peer, messages[0], reply_to=topic_id, schedule=schedule)
+        handles = [await self.input_media(m) for m in messages if media_key(m)]
+        captions = [m.text or "" for m in messages if media_key(m)]
+        if len(handles) == 1:
+            return await self.client.send_file(peer, handles[0], caption=captions[0], reply_to=topic_id, schedule=schedule)
+        return await self.client.send_file(peer, handles, caption=captions, reply_to=topic_id, schedule=schedule)
+
+# --- Session Lifecycle ---
+
+class SessionManager:
+    """
+    Connects and authorizes a client once, then keeps a cached "ready" state so the
+    per-message path is a plain flag check. Dropped connections are re-established
+    with capped exponential backoff.
+    """
+    def __init__(self, client, phone_number, max_attempts=6, max_backoff=60, interactive=True):
+        self.client = client
         self.phone_number = phone_number
-        self.client = TelegramClient('session_' + phone_number, api_id, api_hash)
+        self.interactive = interactive  # Headless runs must never block on a login prompt
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.authorized = False
+
+    @property
+    def ready(self):
+        return self.authorized and self.client.is_connected()
+
+    async def ensure_ready(self):
+        """Fast path when already connected and authorized; otherwise (re)connects and logs in."""
+        if self.ready:
+            return
+        if not self.client.is_connected():
+            await self._connect()
+        if not self.authorized:
+            await self._authorize()
 
-    async def _ensure_authorized(self):
-        """Handle connection and login."""
-        await self.client.connect()
+    async def _connect(self):
+        backoff = 1
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await self.client.connect()
+                return
+            except OSError as e:
+                if attempt == self.max_attempts:
+                    raise
+                print(f"⚠️ Connection failed ({e}), retrying in {backoff}s...")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def _authorize(self):
         if not await self.client.is_user_authorized():
+            if not self.interactive:
+                raise RuntimeError(f"Session for {self.phone_number} is not authorized. Log in once from the interactive menu.")
             try:
                 await self.client.send_code_request(self.phone_number)
                 code = input('Enter the code you received: ')
@@ -61,104 +515,245 @@ class TelegramForwarder:
             except errors.rpcerrorlist.SessionPasswordNeededError:
                 password = input('Two-step verification is enabled. Enter your password: ')
                 await self.client.sign_in(password=password)
+        self.authorized = True
+
+    def invalidate(self):
+        """Forces a full authorization check on the next ensure_ready (e.g. after the session was revoked)."""
+        self.authorized = False
+
+# Errors meaning the session itself is no longer logged in
+# (matched by class name so defining them doesn't import Telethon)
+SESSION_LOST_ERRORS = ("AuthKeyUnregisteredError", "SessionRevokedError", "SessionExpiredError")
+
+# --- Crypto Backend ---
+
+# android_version/main.py carries a copy of this backend (the APK only packages that folder);
+# keep the two in step.
+
+# OpenSSL's libcrypto by file name, for systems where ctypes.util.find_library can't see it
+# (the APK's bundled openssl recipe, Termux)
+LIBCRYPTO_NAMES = ("libcrypto.so", "libcrypto.so.3", "libcrypto.so.1.1", "libcrypto1.1.so", "libcrypto3.so")
+
+_crypto_impls = {}  # name -> implementation, fastest first; filled by crypto_backends()
+active_crypto = None
+
+def _openssl_ige():
+    """
+    (encrypt_ige, decrypt_ige) calling OpenSSL's AES_ige_encrypt directly on the byte buffers, or None.
+    Telethon's own libssl binding copies every byte into a ctypes array first, which costs
+    more than the encryption itself. ctypes is only imported when a backend is selected.
+    """
+    import ctypes
+    import ctypes.util
+
+    class AesKey(ctypes.Structure):
+        _fields_ = [("rd_key", ctypes.c_uint32 * 60), ("rounds", ctypes.c_int)]  # OpenSSL's AES_KEY
+
+    names = [ctypes.util.find_library("crypto")] + list(LIBCRYPTO_NAMES)
+    for name in filter(None, names):
+        try:
+            lib = ctypes.CDLL(name)
+            ige = lib.AES_ige_encrypt
+        except (OSError, AttributeError):
+            continue
+        ige.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+        ige.restype = None
+        for setup in (lib.AES_set_encrypt_key, lib.AES_set_decrypt_key):
+            setup.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p]
+
+        def run(data, key, iv, encrypt):
+            aes_key = AesKey()
+            (lib.AES_set_encrypt_key if encrypt else lib.AES_set_decrypt_key)(bytes(key), len(key) * 8, ctypes.byref(aes_key))
+            out = ctypes.create_string_buffer(len(data))
+            # The IV buffer is updated in place, so hand OpenSSL a copy
+            ige(bytes(data), out, len(data), ctypes.byref(aes_key), ctypes.create_string_buffer(bytes(iv), len(iv)), int(encrypt))
+            return out.raw
+
+        return (lambda data, key, iv: run(data, key, iv, True)), (lambda data, key, iv: run(data, key, iv, False))
+    return None
+
+def crypto_backends():
+    """
+    AES-IGE implementations usable here, fastest first: the cryptg extension, OpenSSL's
+    libcrypto through ctypes, then pure-Python pyaes (always present).
+    """
+    if not _crypto_impls:
+        try:
+            _crypto_impls["cryptg"] = importlib.import_module("cryptg")
+        except ImportError:
+            pass
+        openssl = _openssl_ige()
+        if openssl:
+            _crypto_impls["openssl"] = openssl
+        _crypto_impls["pyaes"] = None
+    return _crypto_impls
+
+def use_crypto_backend(name):
+    """Routes all of Telethon's MTProto encryption (uploads and downloads included) through one backend."""
+    global active_crypto
+    impls = crypto_backends()
+    if name not in impls:
+        raise ValueError(f"Crypto backend not available: {name} (available: {', '.join(impls)})")
+    # telethon.crypto.aes tries cryptg, then its libssl module's functions, then pyaes on every call
+    aes = importlib.import_module("telethon.crypto.aes")
+    aes.cryptg = impls["cryptg"] if name == "cryptg" else None
+    aes.libssl.encrypt_ige, aes.libssl.decrypt_ige = impls["openssl"] if name == "openssl" else (None, None)
+    active_crypto = name
+    return name
+
+def select_crypto_backend(preferred=CRYPTO_BACKEND):
+    """Activates `preferred` if it's available, else the fastest backend. Returns the active backend's name."""
+    if preferred and preferred not in crypto_backends():
+        console.print(f"[yellow]⚠️ MOONTELE_CRYPTO={preferred} is not available here, using the fastest backend.[/yellow]")
+        preferred = None
+    return use_crypto_backend(preferred or next(iter(crypto_backends())))
+
+# --- Core Logic ---
+
+# Errors Telegram returns when a stored access_hash no longer matches the peer
+STALE_PEER_ERRORS = ("ChannelInvalidError", "PeerIdInvalidError", "UserIdInvalidError", "ChatIdInvalidError")
+
+class TelegramForwarder:
+    def __init__(self, api_id, api_hash, phone_number, interactive=True):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.phone_number = phone_number
+        self.interactive = interactive
+        self._client = None
+        self._session = None
+        self._topic_resolver = None
+        self._media = None
+        self.peer_cache = PeerCache(PEER_CACHE_FILE.format(phone_number))
+        self.last_error = None
+        self.sources = {}  # link -> loaded source message(s) for the current broadcast, see load_source
+        self.chat_info = {}  # marked id -> (fetched_at, Chat/Channel/User or error str, slowmode seconds)
+
+    @property
+    def client(self):
+        """The TelegramClient, built on first use so menu paths without network never import Telethon."""
+        if self._client is None:
+            if active_crypto is None:
+                select_crypto_backend()
+            self.client = TelegramClient('session_' + self.phone_number, self.api_id, self.api_hash)
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+        if self._session: self._session.client = value
+        if self._topic_resolver: self._topic_resolver.client = value
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = SessionManager(self.client, self.phone_number, interactive=self.interactive)
+        return self._session
+
+    @property
+    def topic_resolver(self):
+        if self._topic_resolver is None:
+            self._topic_resolver = TopicResolver(self.client)
+        return self._topic_resolver
+
+    @property
+    def media(self):
+        if self._media is None:
+            self._media = MediaPipeline(self.client)
+        return self._media
+
+    async def close(self):
+        self.peer_cache.save()
+        if self._client is not None:
+            await self._client.disconnect()
+
+    def _record_error(self, e):
+        self.last_error = e
+        if type(e).__name__ in SESSION_LOST_ERRORS and self._session:
+            self._session.invalidate()
+
+    async def get_peer(self, chat):
+        """Returns the cached peer dict for a chat id / username, resolving it once on a miss."""
+        entry = self.peer_cache.get(chat)
+        if entry:
+            return entry
+        entity = await self.client.get_entity(chat)
+        return self.peer_cache.put(entity)
+
+    async def get_input_peer(self, chat):
+        """Like get_input_entity, but served from the on-disk peer cache when possible."""
+        if getattr(chat, 'SUBCLASS_OF_ID', None) == 0xc91c90b6:  # Already an InputPeer
+            return chat
+        entry = await self.get_peer(chat)
+        return input_peer_from_dict(entry) if entry else await self.client.get_input_entity(chat)
+
+    def _target_info(self, peer, input_str, type_label):
+        return {
+            "chat_id": peer["id"],
+            "chat_title": peer["title"],
+            "topic_id": None,
+            "topic_title": None,
+            "type": type_label,
+            "peer_type": peer["type"],
+            "access_hash": peer["access_hash"],
+            "source": input_str,
+        }
+
+    @staticmethod
+    def _topic_from_message(message, peer, topic_id_from_url=None):
+        """Detects the forum topic a message belongs to. The URL topic (private links) wins."""
+        topic_id = None
+        if message:
+            # Check for Topic info in message
+            if message.reply_to and message.reply_to.forum_topic:
+                topic_id = message.reply_to.reply_to_top_id or message.reply_to.reply_to_msg_id
+            elif message.reply_to and message.reply_to.reply_to_msg_id:
+                # Sometimes in forums, reply_to points to the thread start
+                # We might want to assume it's the topic if the group is a forum
+                if peer.get("forum"):
+                    topic_id = message.reply_to.reply_to_msg_id
+        # Override if URL specifically had topic (stronger signal for private links)
+        return topic_id_from_url or topic_id
 
     async def resolve_target_from_input(self, input_str):
         """
         Detects if input is User ID or Link, validates it, and returns target info.
         Returns: dict or None
         """
-        await self._ensure_authorized()
+        await self.session.ensure_ready()
         input_str = input_str.strip()
-        
-        target_info = {
-            "chat_id": None,
-            "chat_title": None,
-            "topic_id": None,
-            "topic_title": None,
-            "type": "Unknown"
-        }
 
         try:
             # 1. Check if input is purely numeric (User ID)
             if input_str.isdigit() or (input_str.startswith("-") and input_str[1:].isdigit()):
-                user_id = int(input_str)
-                entity = await self.client.get_entity(user_id)
-                target_info["chat_id"] = entity.id
-                target_info["chat_title"] = f"{entity.first_name} {entity.last_name or ''}".strip() if hasattr(entity, 'first_name') else (entity.title if hasattr(entity, 'title') else "Unknown")
-                target_info["type"] = "User/Chat"
-                return target_info
+                peer = await self.get_peer(int(input_str))
+                return self._target_info(peer, input_str, "User/Chat")
 
             # 2. Check if input is a Link
             elif "t.me/" in input_str:
-                # Remove protocol and standard clean up
-                clean_link = input_str.replace("https://", "").replace("http://", "").replace("t.me/", "")
-                parts = clean_link.split("/")
-                
-                chat_identifier = None
-                msg_id = None
-                topic_id_from_url = None
-
-                # Handle Private Link /c/
-                if parts[0] == "c":
-                    # format: c/CHAT_ID/MSG_ID or c/CHAT_ID/TOPIC_ID/MSG_ID
-                    if len(parts) >= 3:
-                        chat_identifier = int(f"-100{parts[1]}") # Add -100 prefix for private supergroups
-                        msg_id = int(parts[-1].split("?")[0])
-                        
-                        # If there are 4 parts (c/id/topic/msg), grab topic
-                        if len(parts) == 4:
-                            topic_id_from_url = int(parts[2])
-                else:
-                    # format: username/MSG_ID or username/topic/MSG_ID (rare)
-                    chat_identifier = parts[0]
-                    if len(parts) > 1:
-                        msg_id = int(parts[-1].split("?")[0])
-
-                if not chat_identifier:
+                parsed = parse_target_link(input_str)
+                if not parsed:
                     console.print("[red]❌ Could not parse link format.[/red]")
                     return None
+                chat_identifier, msg_id, topic_id_from_url = parsed
 
                 # Fetch Message to Validate and get details
                 console.print(f"[dim]🔄 Verifying access to {chat_identifier}...[/dim]")
                 
                 try:
-                    # Get Chat Entity
-                    entity = await self.client.get_entity(chat_identifier)
-                    target_info["chat_id"] = entity.id
-                    target_info["chat_title"] = entity.title if hasattr(entity, 'title') else (entity.username or "Unknown")
-                    target_info["type"] = "Group/Channel"
+                    # Get Chat Entity (peer cache first, network only on a miss)
+                    peer = await self.get_peer(chat_identifier)
+                    entity = input_peer_from_dict(peer)
+                    target_info = self._target_info(peer, input_str, "Group/Channel")
 
                     # If valid message ID exists, use it to detect topic
                     if msg_id:
                         message = await self.client.get_messages(entity, ids=msg_id)
-                        if message:
-                            # Check for Topic info in message
-                            if message.reply_to and message.reply_to.forum_topic:
-                                target_info["topic_id"] = message.reply_to.reply_to_msg_id
-                            elif message.reply_to and message.reply_to.reply_to_msg_id:
-                                # Sometimes in forums, reply_to points to the thread start
-                                # We might want to assume it's the topic if the group is a forum
-                                if getattr(entity, 'forum', False):
-                                    target_info["topic_id"] = message.reply_to.reply_to_msg_id
-                            
-                            # Override if URL specifically had topic (stronger signal for private links)
-                            if topic_id_from_url:
-                                target_info["topic_id"] = topic_id_from_url
+                        target_info["topic_id"] = self._topic_from_message(message, peer, topic_id_from_url)
 
-                    # If we found a topic ID, try to get its title
+                    # If we found a topic ID, get its title from the forum topic metadata
                     if target_info["topic_id"]:
-                        try:
-                            # Attempt to fetch topic info (thread start message)
-                            # In forums, the topic ID is usually the ID of the first message
-                            topic_start_msg = await self.client.get_messages(entity, ids=target_info["topic_id"])
-                            if topic_start_msg:
-                                # Try to find a title (forum topics usually have action message or text)
-                                if hasattr(topic_start_msg, 'action') and hasattr(topic_start_msg.action, 'title'):
-                                    target_info["topic_title"] = topic_start_msg.action.title
-                                else:
-                                    target_info["topic_title"] = topic_start_msg.text[:30] if topic_start_msg.text else f"Topic {target_info['topic_id']}"
-                        except:
-                            target_info["topic_title"] = f"Topic {target_info['topic_id']}"
+                        titles = await self.topic_resolver.titles(peer, [target_info["topic_id"]])
+                        target_info["topic_title"] = titles[target_info["topic_id"]]
 
                     return target_info
 
@@ -173,23 +768,103 @@ class TelegramForwarder:
         except Exception as e:
             console.print(f"[red]❌ Error: {e}[/red]")
             return None
+        finally:
+            self.peer_cache.save()
+
+    async def resolve_targets_bulk(self, lines, concurrency=8, on_progress=None):
+        """
+        Resolves many links / user IDs at once with at most `concurrency` chats in flight.
+        Lines pointing at the same chat share one entity lookup and one batched
+        get_messages(ids=[...]) call. Returns (targets, errors) in input order, where
+        errors is a list of (line_no, line, reason).
+        """
+        await self.session.ensure_ready()
+        groups = {}  # chat -> [(line_no, line, msg_id, topic_id_from_url)]
+        errors_out = []
+        for line_no, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith("#"): continue
+            if line.isdigit() or (line.startswith("-") and line[1:].isdigit()):
+                groups.setdefault(int(line), []).append((line_no, line, None, None))
+            elif "t.me/" in line:
+                parsed = parse_target_link(line)
+                if not parsed:
+                    errors_out.append((line_no, line, "Could not parse link format"))
+                    continue
+                chat, msg_id, topic_id = parsed
+                key = chat.lower() if isinstance(chat, str) else chat
+                groups.setdefault(key, []).append((line_no, line, msg_id, topic_id))
+            else:
+                errors_out.append((line_no, line, "Must be a t.me Link or Numeric User ID"))
+
+        total = sum(len(items) for items in groups.values())
+        done = 0
+        resolved = []  # (line_no, target)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def resolve_group(chat, items):
+            nonlocal done
+            async with semaphore:
+                try:
+                    peer = await self.get_peer(chat)
+                    input_peer = input_peer_from_dict(peer)
+                    is_user = isinstance(chat, int) and items[0][2] is None and items[0][1].lstrip("-").isdigit()
+                    type_label = "User/Chat" if is_user else "Group/Channel"
+
+                    msg_ids = sorted({msg_id for _, _, msg_id, _ in items if msg_id})
+                    messages = {}
+                    if msg_ids:
+                        fetched = await self.client.get_messages(input_peer, ids=msg_ids)
+                        messages = {m.id: m for m in fetched if m}
 
-    async def send_custom_message(self, chat_id, text, topic_id=None, chat_title="Unknown", topic_title=None):
-        await self._ensure_authorized()
+                    targets = []
+                    for line_no, line, msg_id, topic_id_from_url in items:
+                        target = self._target_info(peer, line, type_label)
+                        if msg_id:
+                            target["topic_id"] = self._topic_from_message(messages.get(msg_id), peer, topic_id_from_url)
+                        targets.append((line_no, target))
+
+                    topic_ids = sorted({t["topic_id"] for _, t in targets if t["topic_id"]})
+                    if topic_ids:
+                        titles = await self.topic_resolver.titles(peer, topic_ids)
+                        for _, t in targets:
+                            if t["topic_id"]:
+                                t["topic_title"] = titles[t["topic_id"]]
+                    resolved.extend(targets)
+                except Exception as e:
+                    errors_out.extend((line_no, line, str(e)) for line_no, line, _, _ in items)
+                finally:
+                    done += len(items)
+                    if on_progress: on_progress(done, total)
+
+        await asyncio.gather(*(resolve_group(chat, items) for chat, items in groups.items()))
+        self.peer_cache.save()
+        resolved.sort(key=lambda item: item[0])
+        errors_out.sort(key=lambda item: item[0])
+        return [t for _, t in resolved], errors_out
+
+    async def send_custom_message(self, chat_id, text, topic_id=None, chat_title="Unknown", topic_title=None, schedule=None):
+        await self.session.ensure_ready()
         try:
-            await self.client.send_message(chat_id, text, reply_to=topic_id)
+            sent = await self.client.send_message(chat_id, text, reply_to=topic_id, schedule=schedule)
             target_info = f"{chat_title}" + (f" (Topic: {topic_title})" if topic_title else "")
-            print(f"✅ Sent to: {target_info}")
-            return True
+            print(f"🕒 Scheduled for: {target_info}" if schedule else f"✅ Sent to: {target_info}")
+            return sent
         except Exception as e:
+            self._record_error(e)
             print(f"❌ Failed to send to {chat_title}: {e}")
             return False
 
-    async def forward_existing_message(self, target_chat_id, message_object, topic_id=None, chat_title="Unknown", topic_title=None, as_forward=False):
-        await self._ensure_authorized()
+    async def forward_existing_message(self, target_chat_id, message_object, topic_id=None, chat_title="Unknown", topic_title=None, mode="copy", schedule=None):
+        """
+        Delivers a source message (or album list) in one of SEND_MODES. "forward" and "quiet" stay
+        server-side: a single ForwardMessagesRequest per target covers the whole album.
+        With `schedule` (datetime) Telegram queues it as a scheduled message instead.
+        """
+        await self.session.ensure_ready()
         try:
-            if as_forward:
-                # True Forward
+            if mode in ("forward", "quiet"):
+                # True Forward; "quiet" drops the author header so it reads like a copy
                 if isinstance(message_object, list):
                     msg_ids = [m.id for m in message_object]
                     origin_chat_id = message_object[0].chat_id
@@ -197,15 +872,19 @@ class TelegramForwarder:
                     msg_ids = [message_object.id]
                     origin_chat_id = message_object.chat_id
 
-                from_peer = await self.client.get_input_entity(origin_chat_id)
-                target_peer = await self.client.get_input_entity(target_chat_id)
+                from_peer = await self.get_input_peer(origin_chat_id)
+                target_peer = await self.get_input_peer(target_chat_id)
 
-                await self.client(functions.messages.ForwardMessagesRequest(
+                sent = await self.client(functions.messages.ForwardMessagesRequest(
                     from_peer=from_peer,
                     id=msg_ids,
                     to_peer=target_peer,
-                    top_msg_id=topic_id if topic_id else None
+                    top_msg_id=topic_id if topic_id else None,
+                    drop_author=mode == "quiet",
+                    schedule_date=schedule
                 ))
+            elif mode == "upload":
+                sent = await self.media.send(target_chat_id, message_object, topic_id=topic_id, schedule=schedule)
             else:
                 # Send as Copy (Album support)
                 if isinstance(message_object, list):
@@ -214,23 +893,1349 @@ class TelegramForwarder:
                         if m.text:
                             caption = m.text
                             break
-                    await self.client.send_message(
+                    sent = await self.client.send_message(
                         target_chat_id, 
                         message=caption, 
                         file=message_object, 
-                        reply_to=topic_id
+                        reply_to=topic_id,
+                        schedule=schedule
                     )
                 else:
-                    await self.client.send_message(target_chat_id, message_object, reply_to=topic_id)
+                    sent = await self.client.send_message(target_chat_id, message_object, reply_to=topic_id, schedule=schedule)
                 
             target_info = f"{chat_title}" + (f" (Topic: {topic_title})" if topic_title else "")
-            mode_str = "Forwarded" if as_forward else "Sent Copy"
+            mode_str = "Scheduled" if schedule else "Forwarded" if mode == "forward" else "Sent Copy"
             print(f"✅ {mode_str} to: {target_info}")
-            return True
+            return sent
         except Exception as e:
+            self._record_error(e)
             print(f"❌ Failed to process {chat_title}: {e}")
             return False
 
+    async def load_source(self, link):
+        """
+        Loads the broadcast source a t.me link points to. If the message is part of an album,
+        returns the whole album (list, in order); otherwise the single Message, or None.
+        Fetched with one ranged get_messages call and cached per link for the broadcast it is
+        loaded for; run_broadcast drops the cache when it finishes, so the next run re-reads it.
+        """
+        link = link.strip()
+        if link in self.sources:
+            return self.sources[link]
+        parsed = parse_target_link(link)
+        if not parsed or parsed[1] is None:
+            raise ValueError(f"Not a message link: {link}")
+        chat, msg_id, _ = parsed
+        await self.session.ensure_ready()
+        peer = await self.get_input_peer(chat)
+        # An album holds at most ALBUM_MAX items, so the window around msg_id covers it in one request
+        window = range(max(1, msg_id - ALBUM_MAX + 1), msg_id + ALBUM_MAX)
+        messages = [m for m in await self.client.get_messages(peer, ids=list(window)) if m]
+        message = next((m for m in messages if m.id == msg_id), None)
+        if message is not None and message.grouped_id:
+            album = sorted((m for m in messages if m.grouped_id == message.grouped_id), key=lambda m: m.id)
+            message = album if len(album) > 1 else message
+        if message is not None:  # A miss is retried next time instead of being remembered
+            self.sources[link] = message
+        return message
+
+    async def chat_states(self, peers, ttl=PERMISSION_TTL):
+        """
+        {marked id: (entity or error string, slowmode seconds)} for peer dicts, fetched with one
+        GetChannels / GetChats / GetUsers request per 100 peers and cached for `ttl` seconds.
+        Slow mode needs the full channel, so it is only asked for chats that have it enabled.
+        """
+        now = time.time()
+        missing = {}
+        for peer in peers:
+            key = marked_peer_id(peer)
+            if key not in self.chat_info or now - self.chat_info[key][0] > ttl:
+                missing[key] = peer
+
+        async def fetch(kind, batch):
+            if kind == "channel":
+                ids = [types.InputChannel(p["id"], p["access_hash"]) for p in batch]
+                return (await self.client(functions.channels.GetChannelsRequest(id=ids))).chats
+            if kind == "chat":
+                return (await self.client(functions.messages.GetChatsRequest(id=[p["id"] for p in batch]))).chats
+            return await self.client(functions.users.GetUsersRequest(id=[types.InputUser(p["id"], p["access_hash"]) for p in batch]))
+
+        for kind in ("channel", "chat", "user"):
+            group = [p for p in missing.values() if p["type"] == kind]
+            for i in range(0, len(group), 100):
+                batch = group[i:i + 100]
+                try:
+                    found = {e.id: e for e in await fetch(kind, batch)}
+                except Exception as e:
+                    if len(batch) > 1:  # One bad peer fails the whole batch; isolate it
+                        found = {}
+                        for p in batch:
+                            try:
+                                found.update({x.id: x for x in await fetch(kind, [p])})
+                            except Exception as single_error:
+                                found[p["id"]] = type(single_error).__name__
+                    else:
+                        found = {batch[0]["id"]: type(e).__name__}
+                for p in batch:
+                    entity = found.get(p["id"], "Not found")
+                    slowmode = 0
+                    if getattr(entity, 'slowmode_enabled', False) and not (entity.creator or entity.admin_rights):
+                        try:
+                            full = await self.client(functions.channels.GetFullChannelRequest(input_peer_from_dict(p)))
+                            slowmode = full.full_chat.slowmode_seconds or 0
+                        except Exception:
+                            pass
+                    self.chat_info[marked_peer_id(p)] = (now, entity, slowmode)
+        return {marked_peer_id(p): self.chat_info[marked_peer_id(p)][1:] for p in peers}
+
+    async def refresh_target(self, target):
+        """
+        Re-resolves a template entry whose stored access_hash went stale (or was never stored)
+        and updates it in place. Returns True if the entry changed.
+        """
+        self.peer_cache.invalidate(target['chat_id'])
+        try:
+            source = target.get('source')
+            if source and "t.me/" in source:
+                fresh = await self.resolve_target_from_input(source)
+                peer = {"type": fresh["peer_type"], "access_hash": fresh["access_hash"]} if fresh else None
+            else:
+                chat = target['chat_id']
+                if target.get('peer_type'):
+                    chat = marked_peer_id({"type": target['peer_type'], "id": chat})
+                peer = self.peer_cache.put(await self.client.get_entity(chat))
+                self.peer_cache.save()
+        except Exception as e:
+            console.print(f"[red]❌ Could not refresh {target.get('chat_title')}: {e}[/red]")
+            return False
+        if not peer or (peer["type"], peer["access_hash"]) == (target.get('peer_type'), target.get('access_hash')):
+            return False
+        target['peer_type'] = peer["type"]
+        target['access_hash'] = peer["access_hash"]
+        return True
+
+    async def send_to_target(self, target, text=None, message_object=None, mode="copy", schedule=None):
+        """
+        Sends to a template entry using the InputPeer stored in it, so no lookup RPC is made.
+        Legacy entries are backfilled from the peer cache; a stale hash is refreshed and retried once.
+        Returns (sent result or False, entry_changed).
+        """
+        changed = False
+        peer = target_input_peer(target)
+        if peer is None:
+            cached = self.peer_cache.get(target['chat_id'])
+            if cached:
+                target['peer_type'], target['access_hash'] = cached["type"], cached["access_hash"]
+                peer, changed = input_peer_from_dict(cached), True
+            else:
+                peer = target['chat_id']
+
+        async def attempt(to_peer):
+            if message_object is not None:
+                return await self.forward_existing_message(to_peer, message_object, topic_id=target.get('topic_id'), chat_title=target.get('chat_title'), topic_title=target.get('topic_title'), mode=mode, schedule=schedule)
+            return await self.send_custom_message(to_peer, text, topic_id=target.get('topic_id'), chat_title=target.get('chat_title'), topic_title=target.get('topic_title'), schedule=schedule)
+
+        ok = await attempt(peer)
+        if not ok and type(self.last_error).__name__ in STALE_PEER_ERRORS and await self.refresh_target(target):
+            console.print(f"[dim]♻️ Refreshed stale peer for {target.get('chat_title')}, retrying...[/dim]")
+            changed = True
+            self.last_error = None
+            ok = await attempt(target_input_peer(target))
+        return ok, changed
+
+# --- Client Pool ---
+
+class ClientPool:
+    """
+    Keeps up to `max_clients` authorized forwarders connected so switching accounts is instant.
+    Clients unused for `idle_timeout` seconds, or least recently used past the limit, are closed.
+    Each account's get_me() display name is fetched once and cached in `profiles`.
+    """
+    def __init__(self, max_clients=CLIENT_POOL_SIZE, idle_timeout=CLIENT_IDLE_TIMEOUT):
+        self.max_clients = max(1, max_clients)
+        self.idle_timeout = idle_timeout
+        self.forwarders = {}  # phone -> TelegramForwarder, least recently used first
+        self.last_used = {}
+        self.profiles = {}  # phone -> "First Last (@username)"
+
+    async def acquire(self, account):
+        """Returns a ready forwarder for the account, reusing a warm one when possible."""
+        phone = account['phone']
+        await self._evict(keep=phone)
+        forwarder = self.forwarders.pop(phone, None)
+        if forwarder is None or not forwarder.session.ready:
+            forwarder = forwarder or TelegramForwarder(account['api_id'], account['api_hash'], phone)
+            try:
+                await forwarder.session.ensure_ready()
+                if phone not in self.profiles:
+                    me = await forwarder.client.get_me()
+                    name = f"{me.first_name} {me.last_name or ''}".strip()
+                    self.profiles[phone] = name + (f" (@{me.username})" if me.username else "")
+            except Exception:
+                await forwarder.close()
+                raise
+        self.forwarders[phone] = forwarder
+        self.last_used[phone] = time.monotonic()
+        return forwarder
+
+    async def evict_idle(self, keep=None):
+        """Closes every pooled client except `keep` that has been unused for `idle_timeout`."""
+        now = time.monotonic()
+        for phone in list(self.forwarders):
+            if phone != keep and now - self.last_used[phone] > self.idle_timeout:
+                await self.discard(phone)
+
+    async def _evict(self, keep=None):
+        await self.evict_idle(keep)
+        # Make room for `keep` unless it is already pooled
+        while len(self.forwarders) - (keep in self.forwarders) >= self.max_clients:
+            phone = next((p for p in self.forwarders if p != keep), None)
+            if phone is None: break
+            await self.discard(phone)
+
+    async def discard(self, phone):
+        forwarder = self.forwarders.pop(phone, None)
+        self.last_used.pop(phone, None)
+        if forwarder:
+            await forwarder.close()
+
+    async def close_all(self):
+        for phone in list(self.forwarders):
+            await self.discard(phone)
+
+# --- Broadcast Scheduler ---
+
+class BroadcastScheduler:
+    """
+    Paces a broadcast against Telegram's own limits instead of a fixed sleep.
+    Keeps a per-chat "next allowed send" time (slow mode) and an account-wide one
+    (FloodWait), spaces sends by `min_interval` measured from the start of each
+    request, and re-queues deferred targets for when their window opens.
+    """
+    def __init__(self, min_interval=1.0, max_retries=3, max_wait=900):
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.max_wait = max_wait  # Waits longer than this fail the target instead of stalling the run
+        self.slowmode = {}       # chat_id -> seconds
+        self.next_allowed = {}   # chat_id -> loop time
+        self.global_next = 0.0
+        self.stats = {"sent": 0, "failed": 0, "deferred": 0, "flood_wait": 0.0, "slowmode_wait": 0.0, "idle": 0.0}
+
+    def set_slowmode(self, chat_id, seconds):
+        if seconds:
+            self.slowmode[chat_id] = max(self.slowmode.get(chat_id, 0), seconds)
+
+    def _ready_at(self, chat_id):
+        return max(self.next_allowed.get(chat_id, 0.0), self.global_next)
+
+    async def run(self, targets, send, on_result=None):
+        """
+        send(target) -> (ok, error) performs one delivery attempt.
+        on_result(target, ok, error) is called once per target when it is finished.
+        """
+        loop = asyncio.get_running_loop()
+        queue = [(0.0, i, 0) for i in range(len(targets))]
+        heapq.heapify(queue)
+
+        async def finish(t, ok, error):
+            self.stats["sent" if ok else "failed"] += 1
+            if on_result:
+                await on_result(t, ok, error)
+
+        while queue:
+            due, i, attempts = heapq.heappop(queue)
+            t = targets[i]
+            chat_id = t['chat_id']
+            ready_at = max(due, self._ready_at(chat_id))
+            now = loop.time()
+            if ready_at > now:
+                # Let another target whose window is already open go first
+                if queue and queue[0][0] < ready_at and self._ready_at(targets[queue[0][1]]['chat_id']) < ready_at:
+                    heapq.heappush(queue, (ready_at, i, attempts))
+                    continue
+                self.stats["idle"] += ready_at - now
+                await asyncio.sleep(ready_at - now)
+
+            start = loop.time()
+            self.global_next = start + self.min_interval
+            ok, error = await send(t)
+            if ok:
+                if chat_id in self.slowmode:
+                    self.next_allowed[chat_id] = start + self.slowmode[chat_id]
+                await finish(t, ok, error)
+                continue
+
+            wait = getattr(error, 'seconds', None)
+            if isinstance(error, errors.SlowModeWaitError):
+                self.set_slowmode(chat_id, wait)
+                self.next_allowed[chat_id] = loop.time() + wait
+                self.stats["slowmode_wait"] += wait
+            elif isinstance(error, errors.FloodWaitError):
+                self.global_next = loop.time() + wait
+                self.stats["flood_wait"] += wait
+            else:
+                await finish(t, ok, error)
+                continue
+
+            if wait > self.max_wait or attempts >= self.max_retries:
+                await finish(t, False, error)
+                continue
+            self.stats["deferred"] += 1
+            print(f"⏳ {t.get('chat_title')}: deferred {wait}s by Telegram, will retry")
+            heapq.heappush(queue, (loop.time() + wait, i, attempts + 1))
+        return self.stats
+
+# --- Broadcast Journal ---
+
+def open_db(path=DB_FILE):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")  # Every commit hits the disk before we send the next message
+    return conn
+
+def sent_message_ids(result):
+    """Message ids produced by a send/forward result (Message, list of Messages or Updates)."""
+    if not result or result is True:
+        return []
+    if isinstance(result, list):
+        return [m.id for m in result]
+    if hasattr(result, 'updates'):
+        return [u.message.id for u in result.updates
+                if isinstance(u, (types.UpdateNewMessage, types.UpdateNewChannelMessage, types.UpdateNewScheduledMessage))]
+    return [result.id] if hasattr(result, 'id') else []
+
+class BroadcastJournal:
+    """
+    Append-only log of each broadcast target's outcome (pending / sent / scheduled / failed / deleted + message ids),
+    keyed by broadcast id and (chat_id, topic_id). The latest row per target is its status,
+    so a killed run can be resumed without resending to targets that already got it.
+    """
+    def __init__(self, conn=None):
+        self.conn = conn or open_db()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id TEXT PRIMARY KEY,
+                account TEXT NOT NULL,
+                template TEXT,
+                source TEXT NOT NULL,
+                targets TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS broadcast_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                broadcast_id TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                topic_id INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                message_ids TEXT,
+                error TEXT,
+                ts REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_broadcast_log_target ON broadcast_log (broadcast_id, chat_id, topic_id);
+        """)
+
+    def start(self, account, template, source, targets):
+        """Registers a new broadcast with every target pending. `source` is {"kind": "text"|"link", ...}."""
+        broadcast_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO broadcasts (id, account, template, source, targets, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (broadcast_id, account, template, json.dumps(source, ensure_ascii=False), json.dumps(targets, ensure_ascii=False), now))
+            self.conn.executemany(
+                "INSERT INTO broadcast_log (broadcast_id, chat_id, topic_id, status, ts) VALUES (?, ?, ?, 'pending', ?)",
+                [(broadcast_id, t['chat_id'], t.get('topic_id') or 0, now) for t in targets])
+        return broadcast_id
+
+    def record(self, broadcast_id, target, status, message_ids=None, error=None):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO broadcast_log (broadcast_id, chat_id, topic_id, status, message_ids, error, ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (broadcast_id, target['chat_id'], target.get('topic_id') or 0, status,
+                 json.dumps(message_ids) if message_ids else None, error, time.time()))
+
+    def finish(self, broadcast_id):
+        with self.conn:
+            self.conn.execute("UPDATE broadcasts SET finished_at = ? WHERE id = ?", (time.time(), broadcast_id))
+
+    def set_source(self, broadcast_id, source):
+        with self.conn:
+            self.conn.execute("UPDATE broadcasts SET source = ? WHERE id = ?", (json.dumps(source, ensure_ascii=False), broadcast_id))
+
+    def get(self, broadcast_id):
+        row = self.conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        if not row: return None
+        run = dict(row)
+        run["source"] = json.loads(run["source"])
+        run["targets"] = json.loads(run["targets"])
+        return run
+
+    def statuses(self, broadcast_id):
+        """Latest log row per target: {(chat_id, topic_id): row}."""
+        rows = self.conn.execute("""
+            SELECT l.* FROM broadcast_log l
+            JOIN (SELECT MAX(seq) AS seq FROM broadcast_log WHERE broadcast_id = ? GROUP BY chat_id, topic_id) latest
+            ON l.seq = latest.seq""", (broadcast_id,)).fetchall()
+        return {(r["chat_id"], r["topic_id"]): r for r in rows}
+
+    def remaining(self, broadcast_id):
+        """Targets of a broadcast that have not been delivered or queued yet (pending, failed, cancelled...)."""
+        run = self.get(broadcast_id)
+        if not run: return []
+        statuses = self.statuses(broadcast_id)
+        return [t for t in run["targets"]
+                if statuses.get((t['chat_id'], t.get('topic_id') or 0), {"status": "pending"})["status"] not in DELIVERED]
+
+    def scheduled(self, account, template=None):
+        """
+        Broadcasts of an account that still have server-side scheduled messages, soonest first:
+        [run dict + "pending": [(target, message_ids)]].
+        """
+        runs = []
+        for row in self.conn.execute("""
+                SELECT DISTINCT b.id FROM broadcasts b JOIN broadcast_log l ON l.broadcast_id = b.id
+                WHERE b.account = ? AND l.status = 'scheduled' AND (? IS NULL OR b.template = ?)""",
+                (account, template, template)):
+            run = self.get(row["id"])
+            statuses = self.statuses(run["id"])
+            run["pending"] = [(t, json.loads(statuses[key]["message_ids"] or "[]")) for t in run["targets"]
+                              for key in [(t['chat_id'], t.get('topic_id') or 0)]
+                              if key in statuses and statuses[key]["status"] == "scheduled"]
+            if run["pending"]:
+                runs.append(run)
+        return sorted(runs, key=lambda r: r["source"].get("schedule_at") or 0)
+
+    def delivered(self, broadcast_id):
+        """[(target, message_ids)] for every target whose messages are currently live in the chat."""
+        statuses = self.statuses(broadcast_id)
+        run = self.get(broadcast_id)
+        return [(t, json.loads(statuses[key]["message_ids"])) for t in (run["targets"] if run else [])
+                for key in [(t['chat_id'], t.get('topic_id') or 0)]
+                if key in statuses and statuses[key]["status"] == "sent" and statuses[key]["message_ids"]]
+
+    def untracked(self, broadcast_id):
+        """How many targets are marked sent without known message ids (so campaigns can't reach them)."""
+        return sum(1 for r in self.statuses(broadcast_id).values() if r["status"] == "sent" and not r["message_ids"])
+
+    def campaigns(self, account, limit=20):
+        """Recent broadcasts of an account that still have sent messages to edit or delete, newest first."""
+        runs = []
+        for row in self.conn.execute(
+                "SELECT id, template, source, created_at FROM broadcasts WHERE account = ? ORDER BY created_at DESC LIMIT ?",
+                (account, limit * 5)):
+            live = sum(1 for r in self.statuses(row["id"]).values() if r["status"] == "sent" and r["message_ids"])
+            if live:
+                runs.append(dict(row, source=json.loads(row["source"]), live=live))
+                if len(runs) >= limit: break
+        return runs
+
+    def resumable(self, account, limit=20):
+        """Recent broadcasts of an account that still have unsent targets, newest first."""
+        runs = []
+        for row in self.conn.execute(
+                "SELECT id, template, created_at, finished_at FROM broadcasts WHERE account = ? ORDER BY created_at DESC LIMIT ?",
+                (account, limit * 5)):
+            statuses = self.statuses(row["id"])
+            sent = sum(1 for r in statuses.values() if r["status"] in DELIVERED)
+            if sent < len(statuses):
+                runs.append(dict(row, sent=sent, total=len(statuses)))
+                if len(runs) >= limit: break
+        return runs
+
+# --- Target Health ---
+
+# Failures that retrying later won't fix: error classes, plus the matching pre-flight reasons
+PERMANENT_ERRORS = {
+    "ChatWriteForbiddenError", "ChannelPrivateError", "UserBannedInChannelError", "ChatAdminRequiredError",
+    "ChannelInvalidError", "ChatIdInvalidError", "PeerIdInvalidError", "TopicDeletedError", "UserIsBlockedError",
+    "InputUserDeactivatedError", "ChatRestrictedError", "ChatGuestSendForbiddenError",
+    "Banned", "Banned or private", "Not found", "Not a member", "Deleted account", "Group deactivated (migrated)",
+    "Topic deleted", "Channel: no post rights",
+    # Pre-flight only reports an invalid peer as final once a fresh lookup failed too
+    *(f"{name} after refresh" for name in STALE_PEER_ERRORS),
+}
+
+class TargetHealth:
+    """
+    Delivery history per (account, chat_id, topic_id) in moontele.db: failure counts, the last
+    error class and when it happened. QUARANTINE_AFTER permanent failures in a row quarantine
+    the target, so broadcasts skip it until it is released or pruned from the templates.
+    """
+    def __init__(self, conn=None):
+        self.conn = conn or open_db()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS target_health (
+                account TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                topic_id INTEGER NOT NULL DEFAULT 0,
+                chat_title TEXT,
+                failures INTEGER NOT NULL DEFAULT 0,
+                permanent INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                last_error_at REAL,
+                last_ok_at REAL,
+                quarantined_at REAL,
+                PRIMARY KEY (account, chat_id, topic_id)
+            );
+        """)
+
+    def record_ok(self, account, target):
+        """Clears a target's failure streak (and quarantine). Targets that never failed have no row."""
+        with self.conn:
+            self.conn.execute("""
+                UPDATE target_health SET failures = 0, permanent = 0, last_ok_at = ?, quarantined_at = NULL
+                WHERE account = ? AND chat_id = ? AND topic_id = ?""",
+                (time.time(), account, target['chat_id'], target.get('topic_id') or 0))
+
+    def record_failure(self, account, target, error_name):
+        """Counts a failure; returns True if it just put the target into quarantine."""
+        key = (account, target['chat_id'], target.get('topic_id') or 0)
+        row = self.conn.execute("SELECT * FROM target_health WHERE account = ? AND chat_id = ? AND topic_id = ?", key).fetchone()
+        failures = (row["failures"] if row else 0) + 1
+        permanent = (row["permanent"] if row else 0) + 1 if error_name in PERMANENT_ERRORS else 0
+        now = time.time()
+        quarantined_at = row["quarantined_at"] if row and row["quarantined_at"] else (now if permanent >= QUARANTINE_AFTER else None)
+        with self.conn:
+            self.conn.execute("""
+                INSERT OR REPLACE INTO target_health
+                (account, chat_id, topic_id, chat_title, failures, permanent, last_error, last_error_at, last_ok_at, quarantined_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (*key, target.get('chat_title'), failures, permanent, error_name, now,
+                 row["last_ok_at"] if row else None, quarantined_at))
+        return bool(quarantined_at) and not (row and row["quarantined_at"])
+
+    def quarantined(self, account):
+        """{(chat_id, topic_id): row} of the account's quarantined targets."""
+        rows = self.conn.execute(
+            "SELECT * FROM target_health WHERE account = ? AND quarantined_at IS NOT NULL ORDER BY quarantined_at", (account,))
+        return {(r["chat_id"], r["topic_id"]): dict(r) for r in rows}
+
+    def report(self, account):
+        """Every target with failures on record, worst first."""
+        rows = self.conn.execute("""
+            SELECT * FROM target_health WHERE account = ? AND failures > 0
+            ORDER BY quarantined_at IS NULL, permanent DESC, failures DESC""", (account,))
+        return [dict(r) for r in rows]
+
+    def release(self, account, keys=None):
+        """Lifts quarantine (and resets the streak) for the given (chat_id, topic_id) keys, or all."""
+        keys = list(keys) if keys is not None else list(self.quarantined(account))
+        with self.conn:
+            self.conn.executemany("""
+                UPDATE target_health SET permanent = 0, quarantined_at = NULL
+                WHERE account = ? AND chat_id = ? AND topic_id = ?""", [(account, c, t) for c, t in keys])
+
+    def forget(self, account, keys):
+        with self.conn:
+            self.conn.executemany("DELETE FROM target_health WHERE account = ? AND chat_id = ? AND topic_id = ?",
+                                  [(account, c, t) for c, t in keys])
+
+def prune_quarantined(account, health=None, store=None):
+    """Removes every quarantined target from all of the account's templates. Returns (targets, template rows removed)."""
+    health = health or TargetHealth()
+    store = store or open_template_store(account)
+    keys = list(health.quarantined(account))
+    removed = store.remove_everywhere(account, keys)
+    health.forget(account, keys)
+    return len(keys), removed
+
+# --- Dialog Index ---
+
+GENERAL_TOPIC = 1  # A forum's "General" topic; sending without a topic lands there
+
+def fuzzy_score(query, text):
+    """
+    Ranks `text` for a search query, higher is better, None if it doesn't match. Every word of the
+    query must appear, either as a substring or with its letters in order (word starts count more).
+    """
+    text = text.lower()
+    total = 0
+    for word in query.lower().split():
+        pos = text.find(word)
+        if pos >= 0:
+            total += 100 + (20 if pos == 0 or not text[pos - 1].isalnum() else 0) - min(pos, 20)
+            continue
+        prev = -1
+        for ch in word:
+            i = text.find(ch, prev + 1)
+            if i < 0:
+                return None
+            total += 3 if i == prev + 1 else 2 if i == 0 or not text[i - 1].isalnum() else 1
+            prev = i
+    return total
+
+def parse_selection(value, count):
+    """'1,3,5-8' or 'a' -> sorted 0-based indices below `count`; anything unparseable is ignored."""
+    value = value.strip().lower()
+    if value in ("a", "all"):
+        return list(range(count))
+    picked = set()
+    for part in value.replace(" ", ",").split(","):
+        lo, _, hi = part.partition("-")
+        if lo.isdigit() and (not hi or hi.isdigit()):
+            picked.update(i - 1 for i in range(int(lo), int(hi or lo) + 1) if 0 < i <= count)
+    return sorted(picked)
+
+class DialogIndex:
+    """
+    Per-account copy of the chat list (and every forum's topics) in moontele.db, so templates can be
+    built by searching locally instead of resolving one pasted link at a time. Built with one paginated
+    dialogs sweep; later refreshes stop at the first dialog with no new messages and only re-fetch the
+    topics of forums that changed.
+    """
+    def __init__(self, conn=None):
+        self.conn = conn or open_db()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS dialogs (
+                account TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                peer_type TEXT NOT NULL,
+                access_hash INTEGER,
+                title TEXT,
+                username TEXT,
+                forum INTEGER NOT NULL DEFAULT 0,
+                top_message INTEGER,
+                date REAL,
+                PRIMARY KEY (account, chat_id)
+            );
+            CREATE TABLE IF NOT EXISTS dialog_topics (
+                account TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                topic_id INTEGER NOT NULL,
+                title TEXT,
+                closed INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (account, chat_id, topic_id)
+            );
+            CREATE TABLE IF NOT EXISTS dialog_sync (
+                account TEXT PRIMARY KEY,
+                synced_at REAL NOT NULL
+            );
+        """)
+        self._entries = {}  # account -> search entries, rebuilt after a refresh
+
+    def synced_at(self, account):
+        row = self.conn.execute("SELECT synced_at FROM dialog_sync WHERE account = ?", (account,)).fetchone()
+        return row["synced_at"] if row else None
+
+    async def _fetch_topics(self, client, peer):
+        """Every topic of a forum, paging GetForumTopics 100 at a time."""
+        input_peer = input_peer_from_dict(peer)
+        topics, offset = [], (None, 0, 0)
+        while True:
+            result = await client(functions.messages.GetForumTopicsRequest(
+                peer=input_peer, offset_date=offset[0], offset_id=offset[1], offset_topic=offset[2], limit=100))
+            page = [t for t in result.topics if isinstance(t, types.ForumTopic)]
+            topics.extend(page)
+            if len(result.topics) < 100 or len(topics) >= result.count or not page:
+                return topics
+            dates = {m.id: m.date for m in result.messages}
+            last = page[-1]
+            offset = (dates.get(last.top_message, last.date), last.top_message, last.id)
+
+    async def refresh(self, forwarder, account, full=False):
+        """
+        Brings the index up to date. `full` walks every dialog (and drops chats you've left);
+        otherwise the sweep stops at the first unpinned dialog whose last message is already indexed.
+        Returns {"dialogs": updated, "forums": forums whose topics were re-fetched}.
+        """
+        await forwarder.session.ensure_ready()
+        client = forwarder.client
+        known = {r["chat_id"]: r["top_message"] for r in
+                 self.conn.execute("SELECT chat_id, top_message FROM dialogs WHERE account = ?", (account,))}
+        full = full or not known
+        seen, rows, forums = set(), [], []
+        async for dialog in client.iter_dialogs(ignore_migrated=True):
+            peer = peer_to_dict(dialog.entity)
+            if not peer or peer["id"] in seen:
+                continue
+            top = dialog.dialog.top_message
+            if not full and not dialog.pinned and known.get(peer["id"]) == top:
+                break  # Dialogs come newest first, so the rest are unchanged
+            seen.add(peer["id"])
+            rows.append((account, peer["id"], peer["type"], peer["access_hash"], peer["title"], peer["username"],
+                         int(peer["forum"]), top, dialog.date.timestamp() if dialog.date else None))
+            if peer["forum"] and (full or known.get(peer["id"]) != top):
+                forums.append(peer)
+
+        topics = {}
+        for peer in forums:
+            try:
+                topics[peer["id"]] = await self._fetch_topics(client, peer)
+            except Exception as e:
+                console.print(f"[yellow]⚠️ Topics of {peer['title']}: {e}[/yellow]")
+
+        with self.conn:
+            if full:
+                self.conn.execute("DELETE FROM dialogs WHERE account = ?", (account,))
+            self.conn.executemany("INSERT OR REPLACE INTO dialogs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            if full:
+                self.conn.execute("""
+                    DELETE FROM dialog_topics WHERE account = ?
+                    AND chat_id NOT IN (SELECT chat_id FROM dialogs WHERE account = ? AND forum = 1)""", (account, account))
+            for chat_id, chat_topics in topics.items():
+                self.conn.execute("DELETE FROM dialog_topics WHERE account = ? AND chat_id = ?", (account, chat_id))
+                self.conn.executemany("INSERT INTO dialog_topics VALUES (?, ?, ?, ?, ?)",
+                                      [(account, chat_id, t.id, t.title, int(bool(t.closed))) for t in chat_topics])
+            self.conn.execute("INSERT OR REPLACE INTO dialog_sync VALUES (?, ?)", (account, time.time()))
+        self._entries.pop(account, None)
+        return {"dialogs": len(rows), "forums": len(topics)}
+
+    def entries(self, account):
+        """Every pickable target of the account (chats, plus one entry per forum topic), most recent chat first."""
+        if account in self._entries:
+            return self._entries[account]
+        topics = {}
+        for r in self.conn.execute("SELECT * FROM dialog_topics WHERE account = ? ORDER BY topic_id", (account,)):
+            if r["topic_id"] != GENERAL_TOPIC:
+                topics.setdefault(r["chat_id"], []).append(r)
+        entries = []
+        for r in self.conn.execute("SELECT * FROM dialogs WHERE account = ? ORDER BY date DESC", (account,)):
+            base = {
+                "chat_id": r["chat_id"],
+                "chat_title": r["title"],
+                "topic_id": None,
+                "topic_title": None,
+                "type": "User/Chat" if r["peer_type"] == "user" else "Group/Channel",
+                "peer_type": r["peer_type"],
+                "access_hash": r["access_hash"],
+                "source": f"https://t.me/{r['username']}" if r["username"] else "dialog index",
+            }
+            entries.append(base)
+            for t in topics.get(r["chat_id"], []):
+                entries.append(dict(base, topic_id=t["topic_id"], topic_title=t["title"] + (" (closed)" if t["closed"] else "")))
+        self._entries[account] = entries
+        return entries
+
+    def search(self, account, query, limit=30):
+        """Best fuzzy matches for `query` over "chat title > topic title" (and @username)."""
+        scored = []
+        for pos, t in enumerate(self.entries(account)):
+            label = t['chat_title'] + (f" > {t['topic_title']}" if t['topic_title'] else "")
+            if t['source'].startswith("https://t.me/"):
+                label += " @" + t['source'][len("https://t.me/"):]
+            score = fuzzy_score(query, label)
+            if score is not None:
+                scored.append((-score, pos, t))
+        return [t for _, _, t in heapq.nsmallest(limit, scored, key=lambda item: item[:2])]
+
+# --- Pre-flight ---
+
+def required_rights(message_object=None):
+    """ChatBannedRights flags that would block the message: plain text, or the media kinds it carries."""
+    if message_object is None:
+        return ["send_messages", "send_plain"]
+    rights = ["send_messages"]
+    for m in message_object if isinstance(message_object, list) else [message_object]:
+        media = getattr(m, 'media', None)
+        if isinstance(media, types.MessageMediaPhoto):
+            rights += ["send_media", "send_photos"]
+        elif isinstance(media, types.MessageMediaDocument) and media.document:
+            is_video = any(isinstance(a, types.DocumentAttributeVideo) for a in media.document.attributes)
+            rights += ["send_media", "send_videos" if is_video else "send_docs"]
+        elif media and not isinstance(media, types.MessageMediaWebPage):
+            rights.append("send_media")
+        elif m.message:
+            rights.append("send_plain")
+    return list(dict.fromkeys(rights))
+
+def block_reason(entity, rights_needed):
+    """Why the account can't post this kind of message to the entity, or None if it can."""
+    if isinstance(entity, str):
+        return entity
+    if isinstance(entity, (types.ChannelForbidden, types.ChatForbidden)):
+        return "Banned or private"
+    if isinstance(entity, (types.UserEmpty, types.ChatEmpty)):
+        return "Not found"
+    if isinstance(entity, types.User):
+        return "Deleted account" if entity.deleted else None
+    if getattr(entity, 'deactivated', False) or getattr(entity, 'migrated_to', None):
+        return "Group deactivated (migrated)"
+    if entity.left:
+        return "Not a member"
+    if entity.creator:
+        return None
+    if getattr(entity, 'broadcast', False):
+        return None if entity.admin_rights and entity.admin_rights.post_messages else "Channel: no post rights"
+    if entity.admin_rights:
+        return None
+    own = getattr(entity, 'banned_rights', None)
+    if own and own.until_date and 0 < own.until_date.timestamp() < time.time():
+        own = None  # Restriction already expired
+    for label, rights in (("Restricted", own), ("Group disallows", entity.default_banned_rights)):
+        if not rights: continue
+        if rights.view_messages:
+            return "Banned"
+        blocked = [r for r in rights_needed if getattr(rights, r, False)]
+        if blocked:
+            return f"{label}: {', '.join(blocked)}"
+    return None
+
+def estimate_duration(targets, min_interval, slowmode):
+    """Rough run time: sends are spaced by min_interval and repeat sends to one chat by its slow mode."""
+    if not targets: return 0.0
+    per_chat = {}
+    for t in targets:
+        per_chat[t['chat_id']] = per_chat.get(t['chat_id'], 0) + 1
+    return max([len(targets) * min_interval] + [(n - 1) * slowmode.get(c, 0) + min_interval for c, n in per_chat.items()])
+
+async def preflight(forwarder, targets, message_object=None, min_interval=1.0, health=None):
+    """
+    Checks every target before a broadcast: membership, bans/restrictions for the message type,
+    admin rights in channels, closed or deleted forum topics, and slow mode. With `health`,
+    quarantined targets are blocked up front without any request.
+    Targets whose stored peer turns out stale are re-resolved first (updated in place).
+    Returns {"ok": targets, "blocked": [(target, reason)], "slowmode": {chat_id: seconds},
+    "refreshed": targets whose stored peer changed, "unchecked": count of legacy entries
+    with no stored peer, "eta": seconds}.
+    """
+    rights = required_rights(message_object)
+    held = health.quarantined(forwarder.phone_number) if health else {}
+    quarantined = [(t, f"Quarantined ({held[(t['chat_id'], t.get('topic_id') or 0)]['last_error']})")
+                   for t in targets if (t['chat_id'], t.get('topic_id') or 0) in held]
+    targets = [t for t in targets if (t['chat_id'], t.get('topic_id') or 0) not in held]
+    peers = {}
+    for t in targets:
+        peer = {"type": t["peer_type"], "id": t["chat_id"], "access_hash": t.get("access_hash")} if t.get("peer_type") \
+            else forwarder.peer_cache.get(t['chat_id'])
+        if peer:
+            peers[t['chat_id']] = peer
+    states = await forwarder.chat_states(list({marked_peer_id(p): p for p in peers.values()}.values()))
+
+    # A stale access_hash reads as an invalid peer: re-resolve it, as the send path would, before blocking
+    refreshed = []
+    for chat_id, peer in list(peers.items()):
+        entity, seconds = states[marked_peer_id(peer)]
+        if entity not in STALE_PEER_ERRORS:
+            continue
+        chat_targets = [t for t in targets if t['chat_id'] == chat_id]
+        if not await forwarder.refresh_target(chat_targets[0]):
+            states[marked_peer_id(peer)] = (f"{entity} after refresh", seconds)  # A real block
+            continue
+        for t in chat_targets[1:]:
+            t['peer_type'], t['access_hash'] = chat_targets[0]['peer_type'], chat_targets[0]['access_hash']
+        refreshed.extend(chat_targets)
+        peers[chat_id] = {"type": chat_targets[0]['peer_type'], "id": chat_id, "access_hash": chat_targets[0]['access_hash']}
+        states.update(await forwarder.chat_states([peers[chat_id]], ttl=0))
+
+    reasons, slowmode = {}, {}
+    for chat_id, peer in peers.items():
+        entity, seconds = states[marked_peer_id(peer)]
+        reasons[chat_id] = block_reason(entity, rights)
+        if seconds:
+            slowmode[chat_id] = seconds
+
+    # Forum topics: one batched lookup per chat for every topic it is targeted in
+    topic_reasons = {}
+    for chat_id, peer in peers.items():
+        entity = states[marked_peer_id(peer)][0]
+        topic_ids = [t['topic_id'] for t in targets if t['chat_id'] == chat_id and t.get('topic_id')]
+        if reasons[chat_id] or not topic_ids or not getattr(entity, 'forum', False):
+            continue
+        try:
+            metas = await forwarder.topic_resolver.get_topics(peer, topic_ids)
+        except Exception:
+            continue
+        is_admin = entity.creator or entity.admin_rights
+        for tid, meta in metas.items():
+            if meta and meta["deleted"]:
+                topic_reasons[(chat_id, tid)] = "Topic deleted"
+            elif meta and meta["closed"] and not is_admin:
+                topic_reasons[(chat_id, tid)] = "Topic closed"
+
+    ok, blocked = [], quarantined
+    for t in targets:
+        reason = reasons.get(t['chat_id']) or topic_reasons.get((t['chat_id'], t.get('topic_id')))
+        if reason:
+            blocked.append((t, reason))
+        else:
+            ok.append(t)
+    return {"ok": ok, "blocked": blocked, "slowmode": slowmode, "refreshed": refreshed, "unchecked": len(targets) - sum(1 for t in targets if t['chat_id'] in peers),
+            "eta": estimate_duration(ok, min_interval, slowmode)}
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes}m" if hours else f"{minutes}m {seconds}s"
+
+def save_refreshed(account, template, targets):
+    """Writes re-resolved peers back to the template so the next run starts with the fresh hash."""
+    if not template or not targets: return
+    store = open_template_store(account)
+    for t in targets:
+        store.update_target(account, template, t)
+
+async def preflight_interactive(forwarder, targets, message_object, scheduler, health=None, template=None):
+    """Menu step: runs the pre-flight, prints it, and returns the targets to send to."""
+    with console.status("Pre-flight check..."):
+        report = await preflight(forwarder, targets, message_object, scheduler.min_interval, health=health)
+    save_refreshed(forwarder.phone_number, template, report["refreshed"])
+    for chat_id, seconds in report["slowmode"].items():
+        scheduler.set_slowmode(chat_id, seconds)
+    if report["blocked"]:
+        table = Table(title=f"⚠️ {len(report['blocked'])} targets will fail", header_style="bold yellow")
+        table.add_column("Target")
+        table.add_column("Reason")
+        for t, reason in report["blocked"]:
+            table.add_row(f"{t.get('chat_title')}" + (f" / {t['topic_title']}" if t.get('topic_title') else ""), reason)
+        console.print(table)
+    extra = f", {report['unchecked']} unchecked" if report["unchecked"] else ""
+    console.print(f"[cyan]Pre-flight: {len(report['ok'])} ready{extra}, ETA ~{format_duration(report['eta'])}[/cyan]")
+    if report["blocked"] and not Confirm.ask("Skip the targets that will fail?", default=True):
+        return targets, []
+    return report["ok"], report["blocked"]
+
+def record_skipped(journal, broadcast_id, blocked, health=None, account=None):
+    for t, reason in blocked:
+        journal.record(broadcast_id, t, "skipped", error=f"Pre-flight: {reason}")
+        if health and not reason.startswith("Quarantined"):
+            # A bare stale-peer error was never re-resolved, so it must not count toward quarantine
+            health.record_failure(account, t, "Stale peer" if reason in STALE_PEER_ERRORS else reason)
+
+# --- Instrumentation ---
+
+# Which phase of a send each request type belongs to; anything else counts as "other"
+RPC_PHASES = {
+    "resolve": ("ResolveUsernameRequest", "GetChannelsRequest", "GetChatsRequest", "GetUsersRequest",
+                "GetFullChannelRequest", "GetForumTopicsByIDRequest", "CheckChatInviteRequest"),
+    "download": ("GetFileRequest",),
+    "upload": ("SaveFilePartRequest", "SaveBigFilePartRequest", "UploadMediaRequest"),
+    "send": ("SendMessageRequest", "SendMediaRequest", "SendMultiMediaRequest", "ForwardMessagesRequest"),
+}
+PHASE_OF = {name: phase for phase, names in RPC_PHASES.items() for name in names}
+
+class BroadcastMetrics:
+    """
+    Per-run instrumentation: wraps the client's _call to count requests and their time by type,
+    splits each send attempt into phases (resolve / download / upload / send / other) and
+    collects error classes. summary() folds in the scheduler's wait totals.
+    """
+    def __init__(self):
+        self.rpc = {}        # request type -> count
+        self.rpc_time = {}   # request type -> seconds
+        self.rpc_errors = {}
+        self.errors = {}     # final per-target error class -> count
+        self.attempts = []   # {"chat_id", "topic_id", "total", phase: seconds...}
+        self.current = None
+        self.started = time.perf_counter()
+        self._client = None
+        self._original = None
+
+    def attach(self, client):
+        original = getattr(client, '_call', None)
+        if original is None: return
+        self._client, self._original = client, original
+        self._shadowed = '_call' in vars(client)  # Only restore an attribute that was there before
+
+        async def call(sender, request, *args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await original(sender, request, *args, **kwargs)
+            except Exception as e:
+                self.rpc_errors[type(e).__name__] = self.rpc_errors.get(type(e).__name__, 0) + 1
+                raise
+            finally:
+                elapsed = time.perf_counter() - t0
+                names = [type(r).__name__ for r in request] if isinstance(request, list) else [type(request).__name__]
+                for name in names:
+                    self.rpc[name] = self.rpc.get(name, 0) + 1
+                    self.rpc_time[name] = self.rpc_time.get(name, 0.0) + elapsed / len(names)
+                if self.current is not None:
+                    phase = PHASE_OF.get(names[0], "other")
+                    self.current[phase] = self.current.get(phase, 0.0) + elapsed
+        client._call = call
+
+    def detach(self):
+        if self._client is not None:
+            if self._shadowed:
+                self._client._call = self._original
+            else:
+                del self._client._call
+            self._client = None
+
+    def begin(self, target):
+        self.current = {"chat_id": target['chat_id'], "topic_id": target.get('topic_id'), "_t0": time.perf_counter()}
+
+    def end(self):
+        attempt, self.current = self.current, None
+        attempt["total"] = time.perf_counter() - attempt.pop("_t0")
+        attempt["local"] = max(0.0, attempt["total"] - sum(v for k, v in attempt.items() if k in RPC_PHASES or k == "other"))
+        self.attempts.append(attempt)
+
+    def failed(self, error):
+        name = type(error).__name__ if error else "Unknown"
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, stats):
+        latencies = sorted(a["total"] for a in self.attempts)
+
+        def pct(p):
+            return round(latencies[int(round(p * (len(latencies) - 1)))], 3) if latencies else 0.0
+
+        phases = {}
+        for a in self.attempts:
+            for phase in (*RPC_PHASES, "other", "local"):
+                phases[phase] = phases.get(phase, 0.0) + a.get(phase, 0.0)
+        return {
+            "duration": round(time.perf_counter() - self.started, 3),
+            "sent": stats["sent"], "failed": stats["failed"], "attempts": len(self.attempts),
+            "latency": {"p50": pct(0.5), "p95": pct(0.95), "max": round(latencies[-1], 3) if latencies else 0.0},
+            "phases": {k: round(v, 3) for k, v in phases.items() if v},
+            "waits": {"flood": round(stats["flood_wait"], 3), "slowmode": round(stats["slowmode_wait"], 3),
+                      "pacing": round(stats["idle"], 3)},
+            "rpc": dict(sorted(self.rpc.items(), key=lambda kv: -kv[1])),
+            "rpc_seconds": {k: round(v, 3) for k, v in self.rpc_time.items()},
+            "rpc_errors": self.rpc_errors,
+            "errors": self.errors,
+        }
+
+    def write(self, name, summary, prom_file=None):
+        """Writes metrics/<name>.json (summary + per-attempt timings) and, if asked, a Prometheus textfile."""
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{name}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(dict(summary, targets=[{k: round(v, 4) if isinstance(v, float) else v for k, v in a.items()}
+                                             for a in self.attempts]), f, indent=2)
+        if prom_file:
+            write_prometheus(prom_file, summary)
+        return path
+
+def write_prometheus(path, summary):
+    """Prometheus text exposition of a run summary (node_exporter textfile collector format)."""
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append(f"# HELP moontele_{name} {help_text}")
+        lines.append(f"# TYPE moontele_{name} gauge")
+        for labels, value in samples:
+            label_str = "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}" if labels else ""
+            lines.append(f"moontele_{name}{label_str} {value}")
+
+    metric("broadcast_duration_seconds", "Wall time of the last broadcast", [({}, summary["duration"])])
+    metric("broadcast_targets", "Targets of the last broadcast by outcome",
+           [({"status": "sent"}, summary["sent"]), ({"status": "failed"}, summary["failed"])])
+    metric("send_latency_seconds", "Per-attempt send latency of the last broadcast",
+           [({"quantile": q}, summary["latency"][k]) for q, k in (("0.5", "p50"), ("0.95", "p95"), ("1", "max"))])
+    metric("phase_seconds", "Time spent per phase", [({"phase": k}, v) for k, v in summary["phases"].items()])
+    metric("wait_seconds", "Time spent waiting", [({"kind": k}, v) for k, v in summary["waits"].items()])
+    metric("rpc_requests", "Requests by type", [({"type": k}, v) for k, v in summary["rpc"].items()])
+    metric("rpc_errors", "Request errors by class", [({"class": k}, v) for k, v in summary["rpc_errors"].items()])
+    metric("target_errors", "Final target failures by error class", [({"class": k}, v) for k, v in summary["errors"].items()])
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+def metrics_line(summary):
+    """One-line run summary for the menu and headless output."""
+    top = ", ".join(f"{n} {k.replace('Request', '')}" for k, n in list(summary["rpc"].items())[:3])
+    waits = summary["waits"]
+    errors = ", ".join(f"{k}×{n}" for k, n in summary["errors"].items())
+    return (f"📊 {summary['sent']}/{summary['sent'] + summary['failed']} in {format_duration(summary['duration'])} · "
+            f"latency p50 {summary['latency']['p50']:.2f}s p95 {summary['latency']['p95']:.2f}s · "
+            f"{sum(summary['rpc'].values())} RPCs ({top or '-'}) · "
+            f"waits flood {waits['flood']:.0f}s / slow mode {waits['slowmode']:.0f}s / pacing {waits['pacing']:.0f}s"
+            + (f" · errors {errors}" if errors else ""))
+
+# --- Broadcast Runner ---
+
+async def run_broadcast(forwarder, targets, message_text=None, message_object=None, scheduler=None,
+                        journal=None, broadcast_id=None, on_sending=None, on_result=None, mode="copy", health=None,
+                        schedule=None, prom_file=PROM_FILE):
+    """
+    Delivers one message to every target through the scheduler, journaling each outcome
+    (and feeding TargetHealth, when given, so dead targets end up quarantined).
+    With `schedule` (datetime) every target is queued server-side for that time in one pass.
+    Returns the scheduler stats plus "changed_targets" (entries whose stored peer was refreshed),
+    "metrics" (BroadcastMetrics summary) and "metrics_file".
+    """
+    scheduler = scheduler or BroadcastScheduler()
+    changed_targets = []
+    metrics = BroadcastMetrics()
+
+    async def send(t):
+        if on_sending: on_sending(t)
+        forwarder.last_error = None
+        metrics.begin(t)
+        try:
+            result, changed = await forwarder.send_to_target(t, text=message_text, message_object=message_object, mode=mode, schedule=schedule)
+        finally:
+            metrics.end()
+        if changed and t not in changed_targets:
+            changed_targets.append(t)
+        return result, forwarder.last_error
+
+    async def finished(t, result, error):
+        if not result:
+            metrics.failed(error)
+        if journal:
+            status = ("scheduled" if schedule else "sent") if result else "failed"
+            journal.record(broadcast_id, t, status, message_ids=sent_message_ids(result),
+                           error=f"{type(error).__name__}: {error}" if error else None)
+        if health and result:
+            health.record_ok(forwarder.phone_number, t)
+        elif health and health.record_failure(forwarder.phone_number, t, type(error).__name__ if error else "Unknown"):
+            console.print(f"[yellow]🚫 {t.get('chat_title')} quarantined after repeated {type(error).__name__}[/yellow]")
+        if on_result: on_result(t, result, error)
+
+    media = forwarder.media if mode == "upload" and message_object is not None else None
+    media_before = dict(media.stats) if media else None
+
+    # Let FloodWait surface to the scheduler instead of sleeping inside the request
+    flood_threshold, forwarder.client.flood_sleep_threshold = forwarder.client.flood_sleep_threshold, 0
+    metrics.attach(forwarder.client)
+    try:
+        stats = await scheduler.run(targets, send, finished)
+    finally:
+        metrics.detach()
+        forwarder.client.flood_sleep_threshold = flood_threshold
+        forwarder.peer_cache.save()
+        forwarder.sources.clear()  # Loaded for this run; the next one re-reads a possibly edited source
+    if journal:
+        journal.finish(broadcast_id)
+    if media:
+        stats = dict(stats, media={k: v - media_before[k] for k, v in media.stats.items()})
+    summary = metrics.summary(stats)
+    try:
+        metrics_file = metrics.write(broadcast_id or time.strftime("run-%Y%m%d-%H%M%S"), summary, prom_file)
+    except OSError as e:
+        console.print(f"[yellow]⚠️ Could not write metrics: {e}[/yellow]")
+        metrics_file = None
+    return dict(stats, changed_targets=changed_targets, metrics=summary, metrics_file=metrics_file)
+
+async def broadcast_with_progress(forwarder, targets, scheduler, journal, broadcast_id, message_text=None, message_object=None, mode="copy", health=None, schedule=None):
+    """Menu wrapper around run_broadcast with a Rich progress bar and a summary."""
+    with Progress(SpinnerColumn(), TextColumn("{task.description}"), BarColumn(), TaskProgressColumn(), console=rich_console()) as progress:
+        task = progress.add_task("Sending...", total=len(targets))
+        stats = await run_broadcast(
+            forwarder, targets, message_text=message_text, message_object=message_object,
+            scheduler=scheduler, journal=journal, broadcast_id=broadcast_id, mode=mode, health=health, schedule=schedule,
+            on_sending=lambda t: progress.update(task, description=f"Sending to {t['chat_title']}..."),
+            on_result=lambda t, result, error: progress.advance(task))
+    console.print("[green]DONE![/green]")
+    if schedule:
+        console.print(f"[cyan]🕒 Queued on Telegram for {schedule:%Y-%m-%d %H:%M} — the app can be closed now.[/cyan]")
+    console.print(f"[dim]{'Scheduled' if schedule else 'Sent'} {stats['sent']}, failed {stats['failed']}, deferred {stats['deferred']}x (flood wait {stats['flood_wait']:.0f}s, slow mode {stats['slowmode_wait']:.0f}s)[/dim]")
+    if 'media' in stats:
+        m = stats['media']
+        console.print(f"[dim]Media: {m['downloaded'] / 1024 ** 2:.1f} MB downloaded, {m['uploaded'] / 1024 ** 2:.1f} MB uploaded, {m['reused']} handle reuses[/dim]")
+    cache_stats = forwarder.peer_cache.stats()
+    console.print(f"[dim]Peer cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses[/dim]")
+    console.print(f"[dim]{metrics_line(stats['metrics'])}[/dim]")
+    if stats['failed']:
+        console.print(f"[yellow]Broadcast ID {broadcast_id} — failed targets can be retried via Resume Broadcast.[/yellow]")
+    return stats
+
+def ask_send_mode():
+    modes = list(SEND_MODES)
+    for i, key in enumerate(modes, 1):
+        console.print(f"[{i}] {SEND_MODES[key]}")
+    choice = console.input("Send mode [Default 1]: ").strip()
+    return modes[int(choice) - 1] if choice.isdigit() and 0 < int(choice) <= len(modes) else modes[0]
+
+def ask_scheduler():
+    delay_input = console.input("Min interval between sends (sec) [Default auto]: ")
+    return BroadcastScheduler(min_interval=float(delay_input)) if delay_input else BroadcastScheduler()
+
+def ask_schedule():
+    while True:
+        value = console.input("Schedule for (YYYY-MM-DD HH:MM) [Enter = send now]: ").strip()
+        if not value:
+            return None
+        try:
+            return parse_schedule(value)
+        except ValueError as e:
+            console.print(f"[red]{e}[/red]")
+
+# --- Scheduled Broadcasts ---
+
+def parse_schedule(value):
+    """'YYYY-MM-DD HH:MM' (local time, ISO format) or a unix timestamp -> datetime within Telegram's window."""
+    value = str(value).strip()
+    try:
+        when = datetime.datetime.fromtimestamp(float(value)) if value.replace(".", "", 1).isdigit() \
+            else datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid time: {value} (use YYYY-MM-DD HH:MM)")
+    if when.timestamp() < time.time() + 60:
+        raise ValueError("Schedule time must be at least a minute in the future")
+    if when.timestamp() > time.time() + 365 * 86400:
+        raise ValueError("Telegram only schedules up to a year ahead")
+    return when
+
+async def _pending_by_chat(forwarder, pending):
+    """Groups [(target, message_ids)] per chat: {chat_id: (InputPeer, [(target, ids)])}."""
+    groups = {}
+    for t, ids in pending:
+        if t['chat_id'] not in groups:
+            peer = target_input_peer(t) or await forwarder.get_input_peer(t['chat_id'])
+            groups[t['chat_id']] = (peer, [])
+        groups[t['chat_id']][1].append((t, ids))
+    return groups
+
+async def _delivered_ids(forwarder, peer, entries, schedule_at):
+    """
+    {(chat_id, topic_id): message ids} for targets whose scheduled messages already went out. Telegram
+    re-posts them as new outgoing messages flagged from_scheduled, so one history read around the
+    schedule time finds them; they are matched per topic in send order.
+    """
+    if not schedule_at:
+        return {}
+    try:
+        messages = await forwarder.client.get_messages(
+            peer, limit=100, offset_date=datetime.datetime.fromtimestamp(schedule_at + 600))
+    except Exception:
+        return {}
+    by_topic = {}
+    for m in sorted(messages, key=lambda m: m.id):
+        if not (m.out and getattr(m, 'from_scheduled', False) and m.date and m.date.timestamp() >= schedule_at - 60):
+            continue
+        topic_id = (m.reply_to.reply_to_top_id or m.reply_to.reply_to_msg_id) if m.reply_to and m.reply_to.forum_topic else None
+        by_topic.setdefault(topic_id, []).append(m.id)
+    found = {}
+    for t, ids in entries:
+        queue = by_topic.get(t.get('topic_id') or None, [])
+        found[(t['chat_id'], t.get('topic_id') or 0)], queue[:] = queue[:len(ids)], queue[len(ids):]
+    return found
+
+async def sync_scheduled(forwarder, journal, run):
+    """
+    Checks which of a broadcast's scheduled messages are still queued, with one GetScheduledHistory
+    per chat. Targets whose messages are no longer queued are marked sent, with the ids the messages
+    got in the chat (so campaigns can edit / delete them). Returns the still pending [(target, message_ids)].
+    """
+    await forwarder.session.ensure_ready()
+    pending = []
+    for peer, entries in (await _pending_by_chat(forwarder, run["pending"])).values():
+        history = await forwarder.client(functions.messages.GetScheduledHistoryRequest(peer=peer, hash=0))
+        queued = {m.id for m in getattr(history, 'messages', [])}
+        gone = []
+        for t, ids in entries:
+            still = [i for i in ids if i in queued]
+            if still:
+                pending.append((t, still))
+            else:
+                gone.append((t, ids))
+        delivered = await _delivered_ids(forwarder, peer, gone, run["source"].get("schedule_at")) if gone else {}
+        for t, _ in gone:
+            journal.record(run["id"], t, "sent", message_ids=delivered.get((t['chat_id'], t.get('topic_id') or 0)))
+    run["pending"] = pending
+    return pending
+
+async def reschedule_broadcast(forwarder, journal, run, when):
+    """Moves every still-queued message of a broadcast to `when`. Returns the number of messages moved."""
+    moved = 0
+    for peer, entries in (await _pending_by_chat(forwarder, run["pending"])).values():
+        for t, ids in entries:
+            for msg_id in ids:
+                try:
+                    await forwarder.client(functions.messages.EditMessageRequest(peer=peer, id=msg_id, schedule_date=when))
+                    moved += 1
+                except Exception as e:
+                    if type(e).__name__ != "MessageNotModifiedError":  # Album items move together
+                        console.print(f"[red]❌ {t.get('chat_title')}: {e}[/red]")
+    journal.set_source(run["id"], dict(run["source"], schedule_at=when.timestamp()))
+    return moved
+
+async def cancel_scheduled(forwarder, journal, run):
+    """Deletes a broadcast's queued messages, one DeleteScheduledMessages per chat. Returns targets cancelled."""
+    cancelled = 0
+    for peer, entries in (await _pending_by_chat(forwarder, run["pending"])).values():
+        ids = [i for _, msg_ids in entries for i in msg_ids]
+        try:
+            await forwarder.client(functions.messages.DeleteScheduledMessagesRequest(peer=peer, id=ids))
+        except Exception as e:
+            console.print(f"[red]❌ {entries[0][0].get('chat_title')}: {e}[/red]")
+            continue
+        for t, msg_ids in entries:
+            journal.record(run["id"], t, "cancelled", message_ids=msg_ids)
+            cancelled += 1
+    return cancelled
+
+# --- Campaigns ---
+
+async def sync_all_scheduled(forwarder, journal, account):
+    """Syncs every broadcast of the account that still has scheduled deliveries on record."""
+    for queued in journal.scheduled(account):
+        await sync_scheduled(forwarder, journal, queued)
+
+async def _sync_if_scheduled(forwarder, journal, run):
+    """Picks up the chat message ids of scheduled deliveries that have gone out since the last check."""
+    for queued in journal.scheduled(run["account"], run["template"]):
+        if queued["id"] == run["id"]:
+            await sync_scheduled(forwarder, journal, queued)
+
+async def edit_broadcast(forwarder, journal, run, text, scheduler=None):
+    """
+    Replaces the text (or caption) of everything a broadcast sent, paced by the same
+    BroadcastScheduler as the broadcast itself. Only the first message of each delivery is
+    edited; that is the one carrying the text or the album caption. Returns the scheduler stats.
+    """
+    if run["source"].get("mode") in ("forward", "quiet"):
+        raise RuntimeError("Forwarded messages can't be edited; delete them and broadcast again")
+    await forwarder.session.ensure_ready()
+    await _sync_if_scheduled(forwarder, journal, run)
+    # Edits are not subject to slow mode, only to FloodWait; the fresh scheduler knows no slow modes
+    items = [dict(t, message_ids=ids) for t, ids in journal.delivered(run["id"])]
+    scheduler = scheduler or BroadcastScheduler()
+
+    async def send(t):
+        try:
+            peer = target_input_peer(t) or await forwarder.get_input_peer(t['chat_id'])
+            await forwarder.client.edit_message(peer, t['message_ids'][0], text)
+        except Exception as e:
+            if type(e).__name__ == "MessageNotModifiedError":
+                return True, None
+            return False, e
+        return True, None
+
+    async def finished(t, ok, error):
+        if not ok:
+            console.print(f"[red]❌ {t.get('chat_title')}: {error}[/red]")
+
+    flood_threshold, forwarder.client.flood_sleep_threshold = forwarder.client.flood_sleep_threshold, 0
+    try:
+        stats = await scheduler.run(items, send, finished)
+    finally:
+        forwarder.client.flood_sleep_threshold = flood_threshold
+    if run["source"]["kind"] == "text":
+        journal.set_source(run["id"], dict(run["source"], text=text))  # A resume sends the corrected text
+    return stats
+
+async def delete_broadcast(forwarder, journal, run):
+    """
+    Deletes everything a broadcast sent, for everyone. One channels.DeleteMessages per
+    channel/supergroup (all its topics at once) and one messages.DeleteMessages shared by every
+    private chat and basic group, whose message ids are unique per account. Returns targets retracted.
+    """
+    await forwarder.session.ensure_ready()
+    await _sync_if_scheduled(forwarder, journal, run)
+    groups = await _pending_by_chat(forwarder, journal.delivered(run["id"]))
+    jobs = [(peer, entries) for peer, entries in groups.values() if isinstance(peer, types.InputPeerChannel)]
+    shared = [e for peer, entries in groups.values() if not isinstance(peer, types.InputPeerChannel) for e in entries]
+    if shared:
+        jobs.append((None, shared))
+
+    retracted = 0
+    for peer, entries in jobs:
+        ids = [i for _, msg_ids in entries for i in msg_ids]
+        try:
+            for start in range(0, len(ids), DELETE_BATCH):
+                batch = ids[start:start + DELETE_BATCH]
+                if peer:
+                    await forwarder.client(functions.channels.DeleteMessagesRequest(channel=utils.get_input_channel(peer), id=batch))
+                else:
+                    await forwarder.client(functions.messages.DeleteMessagesRequest(id=batch, revoke=True))
+        except Exception as e:
+            label = entries[0][0].get('chat_title') if peer else "private chats / basic groups"
+            console.print(f"[red]❌ {label}: {e}[/red]")
+            continue
+        for t, msg_ids in entries:
+            journal.record(run["id"], t, "deleted", message_ids=msg_ids)
+            retracted += 1
+    return retracted
+
 # --- Account & Template Managers ---
 
 def load_accounts():
@@ -273,45 +2278,169 @@ def add_account_interactive(accounts):
     print(f"✅ Account '{name}' added!")
     return accounts
 
-def load_templates(account_phone):
-    if not os.path.exists(TEMPLATE_FILE): return {}
-    try:
-        with open(TEMPLATE_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Legacy migration check
+class TemplateStore:
+    """
+    SQLite-backed target templates (in moontele.db). Every add/remove is its own small
+    transaction, and (template, chat_id, topic_id) is a unique index so duplicate checks
+    are a single lookup. The old target_templates.json is imported once and renamed.
+    """
+    def __init__(self, conn=None):
+        self.conn = conn or open_db()
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS templates (
+                id INTEGER PRIMARY KEY,
+                account TEXT NOT NULL,
+                name TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                UNIQUE (account, name)
+            );
+            CREATE TABLE IF NOT EXISTS template_targets (
+                id INTEGER PRIMARY KEY,
+                template_id INTEGER NOT NULL REFERENCES templates(id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                topic_id INTEGER NOT NULL DEFAULT 0,
+                data TEXT NOT NULL,
+                UNIQUE (template_id, chat_id, topic_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_templates_account ON templates (account);
+            CREATE INDEX IF NOT EXISTS idx_template_targets_template ON template_targets (template_id, position);
+            CREATE INDEX IF NOT EXISTS idx_template_targets_chat ON template_targets (chat_id, topic_id);
+        """)
+
+    def migrate_json(self, account_phone, path=TEMPLATE_FILE):
+        """One-time import of the legacy JSON layout (flat or per-phone); the file is renamed afterwards."""
+        if not os.path.exists(path): return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except: return
+        # Legacy flat structure belonged to whichever account opened it first
         if data and isinstance(next(iter(data.values())), list):
-            # Migrate flat structure to per-phone structure
             data = {account_phone: data}
-            with open(TEMPLATE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=4)
-        
-        return data.get(account_phone, {})
-    except: return {}
+        with self.conn:
+            for phone, templates in data.items():
+                for name, targets in templates.items():
+                    self._replace(phone, name, targets)
+        os.replace(path, path + ".migrated")
+
+    def _template_id(self, account, name, create=False):
+        row = self.conn.execute("SELECT id FROM templates WHERE account = ? AND name = ?", (account, name)).fetchone()
+        if row: return row["id"]
+        if not create: return None
+        return self.conn.execute("INSERT INTO templates (account, name, created_at) VALUES (?, ?, ?)",
+                                 (account, name, time.time())).lastrowid
+
+    def _replace(self, account, name, targets):
+        template_id = self._template_id(account, name, create=True)
+        self.conn.execute("DELETE FROM template_targets WHERE template_id = ?", (template_id,))
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO template_targets (template_id, position, chat_id, topic_id, data) VALUES (?, ?, ?, ?, ?)",
+            [(template_id, pos, t['chat_id'], t.get('topic_id') or 0, json.dumps(t, ensure_ascii=False)) for pos, t in enumerate(targets)])
+
+    def list_templates(self, account):
+        """[(name, target_count)] without loading any targets."""
+        rows = self.conn.execute("""
+            SELECT t.name, COUNT(tt.id) AS n FROM templates t
+            LEFT JOIN template_targets tt ON tt.template_id = t.id
+            WHERE t.account = ? GROUP BY t.id ORDER BY t.id""", (account,)).fetchall()
+        return [(r["name"], r["n"]) for r in rows]
+
+    def get_targets(self, account, name):
+        rows = self.conn.execute("""
+            SELECT tt.data FROM template_targets tt JOIN templates t ON t.id = tt.template_id
+            WHERE t.account = ? AND t.name = ? ORDER BY tt.position""", (account, name)).fetchall()
+        return [json.loads(r["data"]) for r in rows]
+
+    def load(self, account):
+        return {name: self.get_targets(account, name) for name, _ in self.list_templates(account)}
+
+    def exists(self, account, name):
+        return self._template_id(account, name) is not None
+
+    def save_template(self, account, name, targets):
+        """Creates or overwrites one template atomically."""
+        with self.conn:
+            self._replace(account, name, targets)
+
+    def add_target(self, account, name, target):
+        """Appends a target; returns False if (chat_id, topic_id) is already in the template."""
+        with self.conn:
+            template_id = self._template_id(account, name, create=True)
+            cur = self.conn.execute("""
+                INSERT OR IGNORE INTO template_targets (template_id, position, chat_id, topic_id, data)
+                VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM template_targets WHERE template_id = ?), ?, ?, ?)""",
+                (template_id, template_id, target['chat_id'], target.get('topic_id') or 0, json.dumps(target, ensure_ascii=False)))
+            return cur.rowcount == 1
+
+    def add_targets(self, account, name, targets):
+        """Appends many targets in one transaction, skipping duplicates. Returns how many were added."""
+        with self.conn:
+            template_id = self._template_id(account, name, create=True)
+            start = self.conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM template_targets WHERE template_id = ?",
+                                      (template_id,)).fetchone()[0]
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO template_targets (template_id, position, chat_id, topic_id, data) VALUES (?, ?, ?, ?, ?)",
+                [(template_id, start + i, t['chat_id'], t.get('topic_id') or 0, json.dumps(t, ensure_ascii=False)) for i, t in enumerate(targets)])
+            return self.conn.total_changes - before
+
+    def update_target(self, account, name, target):
+        """Rewrites the stored fields of an existing target (e.g. a refreshed access_hash)."""
+        with self.conn:
+            self.conn.execute("""
+                UPDATE template_targets SET data = ?
+                WHERE template_id = (SELECT id FROM templates WHERE account = ? AND name = ?) AND chat_id = ? AND topic_id = ?""",
+                (json.dumps(target, ensure_ascii=False), account, name, target['chat_id'], target.get('topic_id') or 0))
+
+    def remove_target(self, account, name, chat_id, topic_id):
+        with self.conn:
+            self.conn.execute("""
+                DELETE FROM template_targets
+                WHERE template_id = (SELECT id FROM templates WHERE account = ? AND name = ?) AND chat_id = ? AND topic_id = ?""",
+                (account, name, chat_id, topic_id or 0))
+
+    def delete(self, account, name):
+        with self.conn:
+            self.conn.execute("DELETE FROM templates WHERE account = ? AND name = ?", (account, name))
+
+    def remove_everywhere(self, account, keys):
+        """Drops the given (chat_id, topic_id) targets from all of the account's templates; returns rows removed."""
+        with self.conn:
+            cur = self.conn.executemany("""
+                DELETE FROM template_targets
+                WHERE template_id IN (SELECT id FROM templates WHERE account = ?) AND chat_id = ? AND topic_id = ?""",
+                [(account, chat_id, topic_id or 0) for chat_id, topic_id in keys])
+        return cur.rowcount
+
+def open_template_store(account_phone):
+    store = TemplateStore()
+    store.migrate_json(account_phone)
+    return store
+
+def load_templates(account_phone):
+    return open_template_store(account_phone).load(account_phone)
 
 def save_templates(current_account_templates, account_phone):
-    full_data = {}
-    if os.path.exists(TEMPLATE_FILE):
-        try:
-            with open(TEMPLATE_FILE, 'r', encoding='utf-8') as f:
-                content = json.load(f)
-                if content and not isinstance(next(iter(content.values())), list):
-                    full_data = content
-        except: pass
-    
-    full_data[account_phone] = current_account_templates
-    with open(TEMPLATE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(full_data, f, indent=4, ensure_ascii=False)
+    """Replaces all templates of one account in a single transaction."""
+    store = open_template_store(account_phone)
+    with store.conn:
+        store.conn.execute("DELETE FROM templates WHERE account = ?", (account_phone,))
+        for name, targets in current_account_templates.items():
+            store._replace(account_phone, name, targets)
 
 # --- Menus ---
 
 async def manage_templates(forwarder, account_phone):
+    store = open_template_store(account_phone)
     while True:
-        templates = load_templates(account_phone)
+        templates = store.list_templates(account_phone)  # [(name, count)], targets stay on disk
+        keys = [name for name, _ in templates]
         print_banner()
         console.print(f"[bold cyan]📁 MANAGE TARGETS & TEMPLATES ({account_phone})[/bold cyan]\n")
         
-        console.print(Panel("[1] View Templates       [2] Create New Template\n[3] Edit Template        [4] Delete Template\n[5] Back to Main Menu", title="Actions", border_style="blue"))
+        console.print(Panel("[1] View Templates       [2] Create New Template\n[3] Edit Template        [4] Delete Template\n[5] Bulk Import Targets  [6] Pick from Chat List\n[7] Back to Main Menu", title="Actions", border_style="blue"))
         
         choice = console.input("[bold yellow]❯ Enter choice: [/bold yellow]")
         
@@ -325,9 +2454,8 @@ async def manage_templates(forwarder, account_phone):
             table.add_column("No", style="cyan", justify="right")
             table.add_column("Name", style="white")
             table.add_column("Targets", style="green")
-            keys = list(templates.keys())
-            for i, key in enumerate(keys, 1):
-                table.add_row(str(i), key, str(len(templates[key])))
+            for i, (key, count) in enumerate(templates, 1):
+                table.add_row(str(i), key, str(count))
             console.print(table)
             
             try:
@@ -336,7 +2464,7 @@ async def manage_templates(forwarder, account_phone):
                     idx = int(sel) - 1
                     if 0 <= idx < len(keys):
                         t_name = keys[idx]
-                        targets = templates[t_name]
+                        targets = store.get_targets(account_phone, t_name)
                         
                         detail_table = Table(title=f"Detailed Targets: {t_name}", border_style="cyan")
                         detail_table.add_column("No", justify="right")
@@ -360,10 +2488,11 @@ async def manage_templates(forwarder, account_phone):
         elif choice == "2":
             name = console.input("Enter new template name: ").strip()
             if not name: continue
-            if name in templates:
+            if name in keys:
                 if not Confirm.ask("Template exists. Overwrite?"): continue
             
             new_targets = []
+            seen = set()  # (chat_id, topic_id) already added this session
             console.print(Panel("[bold]Cara Menambahkan Target:[/bold]\n1. Untuk [cyan]Grup/Channel/Forum[/cyan]: Kirim Link Pesan (contoh: https://t.me/grup/123)\n2. Untuk [cyan]User[/cyan]: Kirim User ID (angka)", border_style="green"))
             
             while True:
@@ -376,29 +2505,28 @@ async def manage_templates(forwarder, account_phone):
                 
                 if target:
                     # Check duplicate in current session
-                    if any(t['chat_id'] == target['chat_id'] and t['topic_id'] == target['topic_id'] for t in new_targets):
+                    key = (target['chat_id'], target['topic_id'])
+                    if key in seen:
                         console.print("[yellow]⚠️ Target already in list.[/yellow]")
                     else:
+                        seen.add(key)
                         new_targets.append(target)
                         desc = f"{target['chat_title']}"
                         if target['topic_title']: desc += f" > {target['topic_title']}"
                         console.print(f"[green]✅ Added: {desc}[/green]")
                 
             if new_targets:
-                templates[name] = new_targets
-                save_templates(templates, account_phone)
+                store.save_template(account_phone, name, new_targets)
                 console.print(f"[green]💾 Template '{name}' saved with {len(new_targets)} targets.[/green]")
                 asyncio.sleep(1)
 
         elif choice == "3":
             if not templates: continue
-            keys = list(templates.keys())
             for i, key in enumerate(keys, 1): console.print(f"{i}. {key}")
             try:
                 idx = int(console.input("Select template: ")) - 1
                 if 0 <= idx < len(keys):
                     t_name = keys[idx]
-                    current = templates[t_name]
                     
                     console.print("[1] Add Target  [2] Remove Target")
                     if console.input("Action: ") == "1":
@@ -406,57 +2534,346 @@ async def manage_templates(forwarder, account_phone):
                         with console.status("Resolving..."):
                             target = await forwarder.resolve_target_from_input(user_input)
                         if target:
-                            current.append(target)
-                            save_templates(templates, account_phone)
-                            console.print("[green]✅ Added.[/green]")
+                            if store.add_target(account_phone, t_name, target):
+                                console.print("[green]✅ Added.[/green]")
+                            else:
+                                console.print("[yellow]⚠️ Target already in template.[/yellow]")
                     else:
+                        current = store.get_targets(account_phone, t_name)
                         for i, t in enumerate(current, 1): 
-                            console.print(f"{i}. {t['chat_title']} {f'({t['topic_title']})' if t['topic_title'] else ''}")
-                        rm_idx = int(console.input("Remove number: ")) - 1
-                        if 0 <= rm_idx < len(current):
-                            current.pop(rm_idx)
-                            save_templates(templates, account_phone)
-                            console.print("[green]🗑️ Removed.[/green]")
+                            topic = f"({t['topic_title']})" if t['topic_title'] else ''
+                            console.print(f"{i}. {t['chat_title']} {topic}")
+                        picked = parse_selection(console.input("Remove numbers (e.g. 2 or 1,3,5-8): "), len(current))
+                        for rm_idx in picked:
+                            store.remove_target(account_phone, t_name, current[rm_idx]['chat_id'], current[rm_idx]['topic_id'])
+                        if picked:
+                            console.print(f"[green]🗑️ Removed {len(picked)}.[/green]")
             except: pass
 
         elif choice == "4":
-            keys = list(templates.keys())
             for i, k in enumerate(keys, 1): console.print(f"{i}. {k}")
             try:
                 idx = int(console.input("Delete number: ")) - 1
                 if 0 <= idx < len(keys) and Confirm.ask("Are you sure?"):
-                    del templates[keys[idx]]
-                    save_templates(templates, account_phone)
+                    store.delete(account_phone, keys[idx])
                     console.print("[green]🗑️ Deleted.[/green]")
             except: pass
 
         elif choice == "5":
+            await bulk_import_targets(forwarder, account_phone, store)
+            continue
+
+        elif choice == "6":
+            await pick_dialog_targets(forwarder, account_phone, store)
+            continue
+
+        elif choice == "7":
             break
         
         time.sleep(1)
 
+def read_bulk_lines():
+    """Asks for a file path, or reads a pasted block of links/IDs ending with an empty line."""
+    path = console.input("File path (or press Enter to paste links): ").strip()
+    if path:
+        with open(os.path.expanduser(path), 'r', encoding='utf-8') as f:
+            return f.read().splitlines()
+    console.print("Paste links / user IDs, one per line (Enter on an empty line to finish):")
+    lines = []
+    while True:
+        l = input()
+        if not l: break
+        lines.append(l)
+    return lines
+
+async def bulk_import_targets(forwarder, account_phone, store):
+    """Resolves a file or pasted block of links concurrently and appends them to a template."""
+    name = console.input("Template name (new or existing): ").strip()
+    if not name: return
+    try:
+        lines = read_bulk_lines()
+    except OSError as e:
+        console.print(f"[red]Error reading file: {e}[/red]")
+        time.sleep(2)
+        return
+    if not lines: return
+    conc_input = console.input("Concurrency [Default 8]: ").strip()
+    concurrency = int(conc_input) if conc_input.isdigit() and int(conc_input) > 0 else 8
+
+    with Progress(SpinnerColumn(), TextColumn("{task.description}"), BarColumn(), TaskProgressColumn(), console=rich_console()) as progress:
+        task = progress.add_task("Resolving...", total=None)
+        targets, failures = await forwarder.resolve_targets_bulk(
+            lines, concurrency=concurrency,
+            on_progress=lambda done, total: progress.update(task, completed=done, total=total))
+
+    added = store.add_targets(account_phone, name, targets) if targets else 0
+    if failures:
+        err_table = Table(title="Lines Not Imported", border_style="red")
+        err_table.add_column("Line", justify="right")
+        err_table.add_column("Input", style="white")
+        err_table.add_column("Reason", style="red")
+        for line_no, line, reason in failures:
+            err_table.add_row(str(line_no), line, reason)
+        console.print(err_table)
+    console.print(f"[green]💾 '{name}': {added} added, {len(targets) - added} duplicates skipped, {len(failures)} failed.[/green]")
+    console.input("\n[dim]Press Enter to continue...[/dim]")
+
+async def pick_dialog_targets(forwarder, account_phone, store):
+    """Searches the local chat list and adds any number of chats / forum topics to a template at once."""
+    name = console.input("Template name (new or existing): ").strip()
+    if not name: return
+    index = DialogIndex()
+    synced = index.synced_at(account_phone)
+    if not synced or time.time() - synced > DIALOG_INDEX_TTL:
+        try:
+            with console.status("Syncing chat list..." if synced else "Indexing all chats (first time only)..."):
+                index_stats = await index.refresh(forwarder, account_phone)
+            console.print(f"[dim]Chat list: {index_stats['dialogs']} chats updated, {index_stats['forums']} forums re-read.[/dim]")
+        except Exception as e:
+            console.print(f"[yellow]⚠️ Could not sync the chat list, searching the saved copy: {e}[/yellow]")
+
+    selected, seen = [], {(t['chat_id'], t.get('topic_id')) for t in store.get_targets(account_phone, name)}  # ✓ marks what's already in
+    while True:
+        query = console.input(f"\n[bold yellow]❯ Search chats ({len(selected)} picked; Enter to save, '!' to re-index): [/bold yellow]").strip()
+        if not query: break
+        if query == "!":
+            with console.status("Re-indexing all chats..."):
+                await index.refresh(forwarder, account_phone, full=True)
+            continue
+        matches = index.search(account_phone, query)
+        if not matches:
+            console.print("[yellow]No matching chats.[/yellow]")
+            continue
+        table = Table(box=None)
+        table.add_column("No", style="cyan", justify="right")
+        table.add_column("Chat", style="white")
+        table.add_column("Topic", style="yellow")
+        table.add_column("", style="green")
+        for i, t in enumerate(matches, 1):
+            table.add_row(str(i), t['chat_title'], t['topic_title'] or "-", "✓" if (t['chat_id'], t['topic_id']) in seen else "")
+        console.print(table)
+        for i in parse_selection(console.input("Pick numbers (e.g. 1,3,5-8 or 'a' for all; Enter to search again): "), len(matches)):
+            key = (matches[i]['chat_id'], matches[i]['topic_id'])
+            if key not in seen:
+                seen.add(key)
+                selected.append(matches[i])
+
+    if selected:
+        added = store.add_targets(account_phone, name, selected)
+        console.print(f"[green]💾 '{name}': {added} targets added.[/green]")
+        time.sleep(1)
+
+def target_health_menu(account_phone):
+    """Report of failing targets, with pruning of quarantined ones from every template."""
+    health = TargetHealth()
+    while True:
+        print_banner()
+        rows = health.report(account_phone)
+        if not rows:
+            console.print("[green]✅ No failing targets on record.[/green]")
+            time.sleep(1)
+            return
+        table = Table(title="Target Health", header_style="bold magenta")
+        table.add_column("Target", style="white")
+        table.add_column("Fails", justify="right")
+        table.add_column("Last Error", style="red")
+        table.add_column("When", style="dim")
+        table.add_column("State")
+        for r in rows:
+            name = r["chat_title"] or str(r["chat_id"])
+            if r["topic_id"]:
+                name += f" (topic {r['topic_id']})"
+            state = "[red]🚫 Quarantined[/red]" if r["quarantined_at"] else "[yellow]Failing[/yellow]"
+            table.add_row(name, str(r["failures"]), r["last_error"] or "-",
+                          time.strftime("%Y-%m-%d %H:%M", time.localtime(r["last_error_at"])), state)
+        console.print(table)
+
+        count = sum(1 for r in rows if r["quarantined_at"])
+        console.print(f"\n[P] Prune {count} quarantined from templates  [R] Release quarantine  [B] Back")
+        act = console.input("Choice: ").upper()
+        if act == "P" and count and Confirm.ask(f"Remove {count} quarantined targets from all templates?"):
+            _, removed = prune_quarantined(account_phone, health)
+            console.print(f"[green]✅ Removed {removed} template entries.[/green]")
+            time.sleep(1)
+        elif act == "R":
+            health.release(account_phone)
+        elif act == "B" or not act:
+            return
+
+async def scheduled_menu(forwarder, account_phone):
+    """Lists broadcasts queued on Telegram's side and lets you reschedule or cancel one."""
+    journal = BroadcastJournal()
+    runs = journal.scheduled(account_phone)
+    if not runs:
+        console.print("[yellow]⚠️ No scheduled broadcasts.[/yellow]")
+        time.sleep(1)
+        return
+
+    table = Table(title="Scheduled Broadcasts", box=None)
+    table.add_column("No", style="cyan", justify="right")
+    table.add_column("ID", style="dim")
+    table.add_column("Template", style="white")
+    table.add_column("Scheduled For", style="green")
+    table.add_column("Targets", justify="right")
+    for i, run in enumerate(runs, 1):
+        at = run["source"].get("schedule_at")
+        table.add_row(str(i), run["id"], str(run["template"]),
+                      time.strftime("%Y-%m-%d %H:%M", time.localtime(at)) if at else "-", str(len(run["pending"])))
+    console.print(table)
+
+    sel = console.input("\n[bold yellow]❯ Number (or Enter to back): [/bold yellow]")
+    if not sel.isdigit() or not (0 < int(sel) <= len(runs)): return
+    run = runs[int(sel) - 1]
+    try:
+        with console.status("Checking Telegram's scheduled queue..."):
+            pending = await sync_scheduled(forwarder, journal, run)
+        if not pending:
+            console.print("[green]✅ Everything in this broadcast has already gone out.[/green]")
+            time.sleep(1)
+            return
+        console.print(f"{len(pending)} targets still queued.  [R] Reschedule  [C] Cancel  [B] Back")
+        act = console.input("Choice: ").upper()
+        if act == "R":
+            when = ask_schedule()
+            if when:
+                moved = await reschedule_broadcast(forwarder, journal, run, when)
+                console.print(f"[green]✅ Moved {moved} messages to {when:%Y-%m-%d %H:%M}.[/green]")
+        elif act == "C" and Confirm.ask(f"Delete the scheduled messages for {len(pending)} targets?"):
+            cancelled = await cancel_scheduled(forwarder, journal, run)
+            console.print(f"[green]✅ Cancelled {cancelled} targets.[/green]")
+    except Exception as e:
+        console.print(f"[red]Error: {e}[/red]")
+    time.sleep(2)
+
+async def campaigns_menu(forwarder, account_phone):
+    """Lists broadcasts with messages still live in their chats and lets you edit or delete all of them."""
+    journal = BroadcastJournal()
+    try:
+        with console.status("Checking scheduled broadcasts..."):
+            await sync_all_scheduled(forwarder, journal, account_phone)
+    except Exception as e:
+        console.print(f"[yellow]⚠️ Could not check scheduled broadcasts: {e}[/yellow]")
+    runs = journal.campaigns(account_phone)
+    if not runs:
+        console.print("[yellow]⚠️ No sent broadcasts to manage.[/yellow]")
+        time.sleep(1)
+        return
+
+    table = Table(title="Sent Broadcasts", box=None)
+    table.add_column("No", style="cyan", justify="right")
+    table.add_column("ID", style="dim")
+    table.add_column("Template", style="white")
+    table.add_column("Started", style="dim")
+    table.add_column("Source", style="white")
+    table.add_column("Live", justify="right", style="green")
+    for i, run in enumerate(runs, 1):
+        src = run["source"]
+        preview = (src.get("text") or "").splitlines()[0][:30] if src["kind"] == "text" and src.get("text") else src.get("link", "-")
+        table.add_row(str(i), run["id"], str(run["template"]),
+                      time.strftime("%Y-%m-%d %H:%M", time.localtime(run["created_at"])), preview, str(run["live"]))
+    console.print(table)
+
+    sel = console.input("\n[bold yellow]❯ Number (or Enter to back): [/bold yellow]")
+    if not sel.isdigit() or not (0 < int(sel) <= len(runs)): return
+    run = journal.get(runs[int(sel) - 1]["id"])
+    live = runs[int(sel) - 1]["live"]
+    untracked = journal.untracked(run["id"])
+    if untracked:
+        console.print(f"[yellow]{untracked} delivered targets have no recorded message ids and can't be edited or deleted from here.[/yellow]")
+    console.print(f"{live} targets have this broadcast.  [E] Edit all  [D] Delete all  [B] Back")
+    act = console.input("Choice: ").upper()
+    try:
+        if act == "E":
+            console.print("Type the new text (Enter twice to finish):")
+            lines = []
+            while True:
+                l = input()
+                if not l: break
+                lines.append(l)
+            if lines and Confirm.ask(f"Edit the message in {live} targets?"):
+                stats = await edit_broadcast(forwarder, journal, run, "\n".join(lines), ask_scheduler())
+                console.print(f"[green]✅ Edited {stats['sent']}, failed {stats['failed']}.[/green]")
+        elif act == "D" and Confirm.ask(f"Delete this broadcast from {live} targets for everyone?"):
+            with console.status("Deleting..."):
+                retracted = await delete_broadcast(forwarder, journal, run)
+            console.print(f"[green]✅ Deleted from {retracted} targets.[/green]")
+    except Exception as e:
+        console.print(f"[red]Error: {e}[/red]")
+    time.sleep(2)
+
+async def resume_broadcast(forwarder, account_phone):
+    """Lists interrupted/partially failed broadcasts and re-sends only to targets not yet sent."""
+    journal = BroadcastJournal()
+    runs = journal.resumable(account_phone)
+    if not runs:
+        console.print("[yellow]⚠️ Nothing to resume.[/yellow]")
+        time.sleep(1)
+        return
+
+    table = Table(title="Unfinished Broadcasts", box=None)
+    table.add_column("No", style="cyan", justify="right")
+    table.add_column("ID", style="dim")
+    table.add_column("Template", style="white")
+    table.add_column("Started", style="dim")
+    table.add_column("Sent", style="green")
+    for i, run in enumerate(runs, 1):
+        started = time.strftime("%Y-%m-%d %H:%M", time.localtime(run["created_at"]))
+        state = "" if run["finished_at"] else " (interrupted)"
+        table.add_row(str(i), run["id"], str(run["template"]), started + state, f"{run['sent']}/{run['total']}")
+    console.print(table)
+
+    sel = console.input("\n[bold yellow]❯ Resume number (or Enter to back): [/bold yellow]")
+    if not sel.isdigit() or not (0 < int(sel) <= len(runs)): return
+    broadcast_id = runs[int(sel) - 1]["id"]
+    run = journal.get(broadcast_id)
+    remaining = journal.remaining(broadcast_id)
+
+    message_text, message_object = None, None
+    mode = run["source"].get("mode", "copy")
+    if run["source"]["kind"] == "text":
+        message_text = run["source"]["text"]
+    else:
+        try:
+            message_object = await forwarder.load_source(run["source"]["link"])
+        except Exception as e:
+            console.print(f"[red]Error fetching message: {e}[/red]")
+        if not message_object:
+            time.sleep(2)
+            return
+
+    scheduler = ask_scheduler()
+    health = TargetHealth()
+    remaining, blocked = await preflight_interactive(forwarder, remaining, message_object, scheduler, health, template=run["template"])
+    record_skipped(journal, broadcast_id, blocked, health, account_phone)
+    if remaining and Confirm.ask(f"Resume sending to {len(remaining)} remaining targets?"):
+        stats = await broadcast_with_progress(forwarder, remaining, scheduler, journal, broadcast_id,
+                                              message_text=message_text, message_object=message_object, mode=mode, health=health)
+        save_refreshed(account_phone, run["template"], stats['changed_targets'])
+        time.sleep(2)
+
 async def main():
     print("\n=== Telegram Automation (Lite) ===\n")
+    crypto = select_crypto_backend()
+    print(f"🔐 Crypto backend: {crypto}" + (" (pure Python; 'pip install cryptg' speeds up media transfers)" if crypto == "pyaes" else ""))
     accounts = load_accounts()
     if not accounts:
         accounts = add_account_interactive(accounts)
         if not accounts: return
 
     active_account = accounts[0]
+    pool = ClientPool()
     
     while True:
-        print(f"\n🔑 Logging in as: {active_account['name']}...")
-        forwarder = TelegramForwarder(active_account['api_id'], active_account['api_hash'], active_account['phone'])
-        
+        if active_account['phone'] not in pool.forwarders:
+            print(f"\n🔑 Logging in as: {active_account['name']}...")
         try:
-            await forwarder._ensure_authorized()
-            me = await forwarder.client.get_me()
-            tg_name = f"{me.first_name} {me.last_name or ''}".strip()
-            if me.username:
-                tg_name += f" (@{me.username})"
-            active_account['real_name'] = tg_name
-            save_accounts(accounts)
+            forwarder = await pool.acquire(active_account)
+            tg_name = pool.profiles[active_account['phone']]
+            if active_account.get('real_name') != tg_name:
+                active_account['real_name'] = tg_name
+                save_accounts(accounts)
         except Exception as e:
+            await pool.close_all()
             print(f"❌ Login failed: {e}")
             retry = input("Manage accounts? (y/n): ")
             if retry.lower() == 'y':
@@ -465,6 +2882,8 @@ async def main():
             return
 
         while True:
+            # The prompt below blocks the loop, so idle clients are reaped between menu actions
+            await pool.evict_idle(keep=active_account['phone'])
             print_banner()
             
             # Main Menu
@@ -475,7 +2894,11 @@ async def main():
             menu.add_row("[1]", "📝 Manage Target Templates")
             menu.add_row("[2]", "🚀 Send Message / Broadcast")
             menu.add_row("[3]", "👥 Manage Accounts")
-            menu.add_row("[4]", "🚪 Exit")
+            menu.add_row("[4]", "♻️  Resume Broadcast")
+            menu.add_row("[5]", "🩺 Target Health")
+            menu.add_row("[6]", "📅 Scheduled Broadcasts")
+            menu.add_row("[7]", "🧾 Sent Broadcasts (Edit / Delete)")
+            menu.add_row("[8]", "🚪 Exit")
             
             console.print(Panel(Text(f"Active: {tg_name} ({active_account['phone']})", style="green"), title="Status"))
             console.print(menu)
@@ -486,16 +2909,17 @@ async def main():
                 await manage_templates(forwarder, active_account['phone'])
             
             elif choice == "2":
-                templates = load_templates(active_account['phone'])
+                store = open_template_store(active_account['phone'])
+                templates = store.list_templates(active_account['phone'])
                 if not templates:
                     console.print("[yellow]⚠️ You have no templates. Go to menu [1] first.[/yellow]")
                     import time; time.sleep(2)
                     continue
 
                 console.print("\n[bold cyan]🚀 BROADCAST MODE[/bold cyan]")
-                keys = list(templates.keys())
-                for i, k in enumerate(keys, 1):
-                    console.print(f"{i}. {k} ({len(templates[k])} targets)")
+                keys = [name for name, _ in templates]
+                for i, (k, count) in enumerate(templates, 1):
+                    console.print(f"{i}. {k} ({count} targets)")
                 
                 try:
                     t_idx_input = console.input("Select Template Number: ")
@@ -504,14 +2928,14 @@ async def main():
                     
                     if not (0 <= t_idx < len(keys)): continue
                     
-                    selected_template = templates[keys[t_idx]]
-                    targets = selected_template # List of {chat_id, topic_id...}
+                    targets = store.get_targets(active_account['phone'], keys[t_idx]) # List of {chat_id, topic_id...}
                     
                     console.print(Panel("[1] Manual Text Input\n[2] Forward Existing Message (Link)", title="Source", border_style="blue"))
                     src_choice = console.input("Select Source: ")
                     
                     message_to_send = None
                     msg_obj = None
+                    mode = "copy"
                     
                     if src_choice == "1":
                         console.print("Type message (Enter twice to finish):")
@@ -525,52 +2949,36 @@ async def main():
                     elif src_choice == "2":
                         link = console.input("Paste Message Link: ").strip()
                         if "t.me" in link:
-                            # Parse quickly
                             try:
-                                clean = link.replace("https://", "").replace("t.me/", "")
-                                parts = clean.split("/")
-                                mid = int(parts[-1].split("?")[0])
-                                cid = parts[-2] if parts[-2] != "c" else int(f"-100{parts[1]}") # Crude parse
-                                # Better: re-use resolve logic but we just need object
-                                if isinstance(cid, str) and cid == "c":
-                                     pass 
-                                
-                                # For safety, let's just ask the client to fetch based on simple parse
-                                # If private link with /c/: t.me/c/1234/99
-                                if "/c/" in link:
-                                    c_idx = link.find("/c/")
-                                    sub = link[c_idx+3:]
-                                    p = sub.split("/")
-                                    cid = int(f"-100{p[0]}")
-                                    mid = int(p[-1])
+                                msg_obj = await forwarder.load_source(link)
+                                if isinstance(msg_obj, list):
+                                    console.print(f"[green]✅ Album fetched ({len(msg_obj)} items)![/green]")
+                                elif msg_obj:
+                                    console.print("[green]✅ Message fetched![/green]")
                                 else:
-                                    # public
-                                    p = clean.split("/")
-                                    cid = p[0]
-                                    mid = int(p[-1])
-                                    
-                                msg_obj = await forwarder.client.get_messages(cid, ids=mid)
+                                    console.print("[red]Message not found.[/red]")
                                 if msg_obj:
-                                    console.print("[green]✅ Message fetched![/green]")
+                                    mode = ask_send_mode()
                             except Exception as e:
                                 console.print(f"[red]Error fetching message: {e}[/red]")
                         
                     if message_to_send or msg_obj:
-                        delay_input = console.input("Delay (sec) [Default 5]: ")
-                        delay = float(delay_input) if delay_input else 5.0
+                        scheduler = ask_scheduler()
+                        schedule = ask_schedule()
+                        health = TargetHealth()
+                        send_targets, blocked = await preflight_interactive(forwarder, targets, msg_obj, scheduler, health, template=keys[t_idx])
                         
-                        if Confirm.ask(f"Start sending to {len(targets)} targets?"):
-                            with Progress(SpinnerColumn(), TextColumn("{task.description}"), BarColumn(), TaskProgressColumn(), console=console) as progress:
-                                task = progress.add_task("Sending...", total=len(targets))
-                                for t in targets:
-                                    progress.update(task, description=f"Sending to {t['chat_title']}...")
-                                    if msg_obj:
-                                        await forwarder.forward_existing_message(t['chat_id'], msg_obj, topic_id=t['topic_id'], chat_title=t['chat_title'], topic_title=t['topic_title'])
-                                    else:
-                                        await forwarder.send_custom_message(t['chat_id'], message_to_send, topic_id=t['topic_id'], chat_title=t['chat_title'], topic_title=t['topic_title'])
-                                    progress.advance(task)
-                                    await asyncio.sleep(delay)
-                            console.print("[green]DONE![/green]")
+                        verb = f"Schedule for {schedule:%Y-%m-%d %H:%M}" if schedule else "Start sending"
+                        if send_targets and Confirm.ask(f"{verb} to {len(send_targets)} targets?"):
+                            source = {"kind": "text", "text": message_to_send} if message_to_send else {"kind": "link", "link": link, "mode": mode}
+                            if schedule:
+                                source["schedule_at"] = schedule.timestamp()
+                            journal = BroadcastJournal()
+                            broadcast_id = journal.start(active_account['phone'], keys[t_idx], source, targets)
+                            record_skipped(journal, broadcast_id, blocked, health, active_account['phone'])
+                            stats = await broadcast_with_progress(forwarder, send_targets, scheduler, journal, broadcast_id,
+                                                                  message_text=message_to_send, message_object=msg_obj, mode=mode, health=health, schedule=schedule)
+                            save_refreshed(active_account['phone'], keys[t_idx], stats['changed_targets'])
                             import time; time.sleep(2)
                             
                 except Exception as e:
@@ -594,23 +3002,433 @@ async def main():
                     try:
                         idx = int(console.input("Select Number: ")) - 1
                         if 0 <= idx < len(accounts):
-                            new_acc = accounts[idx]
-                            await forwarder.client.disconnect()
-                            active_account = new_acc
-                            break # Break inner loop to re-login
+                            active_account = accounts[idx]
+                            break # Break inner loop; the pool reuses a warm session if there is one
                     except: pass
                 elif act == "D":
                      try:
                         idx = int(console.input("Delete Number: ")) - 1
                         if 0 <= idx < len(accounts) and accounts[idx] != active_account:
+                            await pool.discard(accounts[idx]['phone'])
                             accounts.pop(idx)
                             save_accounts(accounts)
                             console.print("Deleted.")
                      except: pass
             
             elif choice == "4":
-                await forwarder.client.disconnect()
+                await resume_broadcast(forwarder, active_account['phone'])
+
+            elif choice == "5":
+                target_health_menu(active_account['phone'])
+
+            elif choice == "6":
+                await scheduled_menu(forwarder, active_account['phone'])
+
+            elif choice == "7":
+                await campaigns_menu(forwarder, active_account['phone'])
+
+            elif choice == "8":
+                await pool.close_all()
                 return
 
+# --- Headless CLI ---
+
+# Exit codes for scripted runs
+EXIT_OK, EXIT_ERROR, EXIT_PARTIAL, EXIT_ALL_FAILED = 0, 1, 3, 4
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog="MoonTele.py",
+        description="Telegram Broadcast CLI. Run without arguments for the interactive menu.",
+        epilog="Exit codes: 0 ok, 1 error, 2 bad arguments, 3 partial failure, 4 every target failed.")
+    parser.add_argument("--version", action="version", version=f"MoonTele {__version__}")
+    sub = parser.add_subparsers(dest="command", metavar="command")
+
+    def add_account(p):
+        p.add_argument("--account", help="Phone number or label from accounts.json (default: first account)")
+
+    p = sub.add_parser("broadcast", help="Send one message to every target of a template")
+    add_account(p)
+    p.add_argument("--template", required=True)
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument("--text", help="Message text")
+    src.add_argument("--text-file", help="Read the message text from a file ('-' for stdin)")
+    src.add_argument("--source-link", help="t.me link of an existing message to send")
+    p.add_argument("--mode", choices=list(SEND_MODES), default="copy",
+                   help="How --source-link is delivered: copy, forward, quiet (forward without attribution) or upload (re-upload once, for protected sources)")
+    p.add_argument("--schedule", metavar="WHEN",
+                   help="Queue on Telegram for 'YYYY-MM-DD HH:MM' (local time) or a unix timestamp instead of sending now")
+    p.add_argument("--delay", type=float, help="Minimum seconds between sends (default: automatic pacing)")
+    p.add_argument("--no-preflight", action="store_true", help="Don't check permissions first; try every target")
+    p.add_argument("--prom-file", default=PROM_FILE, help="Also write run metrics in Prometheus text format to this file")
+
+    p = sub.add_parser("resume", help="Continue a broadcast, sending only to targets not sent yet")
+    add_account(p)
+    p.add_argument("broadcast_id")
+    p.add_argument("--delay", type=float, help="Minimum seconds between sends (default: automatic pacing)")
+    p.add_argument("--no-preflight", action="store_true", help="Don't check permissions first; try every target")
+    p.add_argument("--prom-file", default=PROM_FILE, help="Also write run metrics in Prometheus text format to this file")
+
+    p = sub.add_parser("templates", help="List, import or export target templates")
+    tsub = p.add_subparsers(dest="templates_command", metavar="action", required=True)
+    tp = tsub.add_parser("list", help="List templates and target counts")
+    add_account(tp)
+    tp = tsub.add_parser("export", help="Export templates as JSON (target_templates.json layout)")
+    add_account(tp)
+    tp.add_argument("--template", help="Only this template")
+    tp.add_argument("--output", help="Write to a file instead of stdout")
+    tp = tsub.add_parser("import", help="Add targets to a template")
+    add_account(tp)
+    tp.add_argument("--template", help="Template to add to (required with --links)")
+    tsrc = tp.add_mutually_exclusive_group(required=True)
+    tsrc.add_argument("--links", help="File with one t.me link or user ID per line ('-' for stdin)")
+    tsrc.add_argument("--json", help="JSON produced by 'templates export' (no network needed)")
+    tp.add_argument("--concurrency", type=int, default=8)
+
+    p = sub.add_parser("scheduled", help="List, reschedule or cancel broadcasts queued on Telegram")
+    ssub = p.add_subparsers(dest="scheduled_command", metavar="action", required=True)
+    sp = ssub.add_parser("list", help="Scheduled broadcasts and how many targets are still queued")
+    add_account(sp)
+    sp.add_argument("--template")
+    sp = ssub.add_parser("reschedule", help="Move a scheduled broadcast to another time")
+    add_account(sp)
+    sp.add_argument("broadcast_id")
+    sp.add_argument("--at", required=True, metavar="WHEN", help="'YYYY-MM-DD HH:MM' (local time) or a unix timestamp")
+    sp = ssub.add_parser("cancel", help="Delete a broadcast's queued messages")
+    add_account(sp)
+    sp.add_argument("broadcast_id")
+
+    p = sub.add_parser("campaign", help="List, edit or delete the messages a broadcast already sent")
+    csub = p.add_subparsers(dest="campaign_command", metavar="action", required=True)
+    cp = csub.add_parser("list", help="Broadcasts with messages still live and how many targets have them")
+    add_account(cp)
+    cp = csub.add_parser("edit", help="Replace the text / caption of every sent message")
+    add_account(cp)
+    cp.add_argument("broadcast_id")
+    csrc = cp.add_mutually_exclusive_group(required=True)
+    csrc.add_argument("--text", help="New message text")
+    csrc.add_argument("--text-file", help="Read the new text from a file ('-' for stdin)")
+    cp.add_argument("--delay", type=float, help="Minimum seconds between edits (default: automatic pacing)")
+    cp = csub.add_parser("delete", help="Delete every sent message for everyone (batched per chat)")
+    add_account(cp)
+    cp.add_argument("broadcast_id")
+
+    p = sub.add_parser("health", help="Report failing / quarantined targets")
+    add_account(p)
+    act = p.add_mutually_exclusive_group()
+    act.add_argument("--prune", action="store_true", help="Remove quarantined targets from every template")
+    act.add_argument("--release", action="store_true", help="Lift quarantine so the targets are tried again")
+
+    p = sub.add_parser("preflight", help="Check which targets of a template can be sent to, and estimate run time")
+    add_account(p)
+    p.add_argument("--template", required=True)
+    p.add_argument("--source-link", help="Check rights for this message's media instead of plain text")
+    p.add_argument("--delay", type=float, help="Minimum seconds between sends used for the estimate")
+
+    p = sub.add_parser("dialogs", help="Sync or search the local index of your chats and forum topics")
+    dsub = p.add_subparsers(dest="dialogs_command", metavar="action", required=True)
+    dp = dsub.add_parser("sync", help="Update the index (only chats with new messages unless --full)")
+    add_account(dp)
+    dp.add_argument("--full", action="store_true", help="Re-read every chat and drop the ones you've left")
+    dp = dsub.add_parser("search", help="Fuzzy-search the index; prints template targets (no network)")
+    add_account(dp)
+    dp.add_argument("query", nargs="+")
+    dp.add_argument("--limit", type=int, default=30)
+
+    p = sub.add_parser("resolve", help="Resolve links / user IDs and print the target info")
+    add_account(p)
+    p.add_argument("inputs", nargs="+")
+
+    sub.add_parser("startup-profile", help="Show the import-time breakdown of startup")
+    return parser
+
+# Imported lazily; startup-profile reports what each would cost on its own
+HEAVY_MODULES = ["rich.console", "rich.progress", "telethon", "telethon.sync"]
+
+def startup_profile():
+    """Import-time breakdown: this script's own import plus each heavy module, each in a fresh interpreter."""
+    import subprocess
+    this_process_ms = round((time.perf_counter() - STARTUP_T0) * 1000, 1)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    probe = "import sys, time; t = time.perf_counter(); import {}; print((time.perf_counter() - t) * 1000, 'telethon' in sys.modules)"
+
+    def measure(module):
+        out = subprocess.run([sys.executable, "-c", probe.format(module)], cwd=script_dir,
+                             capture_output=True, text=True, check=True).stdout.split()
+        return round(float(out[0]), 1), out[1] == "True"
+
+    base_ms, telethon_loaded = measure(os.path.splitext(os.path.basename(__file__))[0])
+    return {
+        "version": __version__,
+        "python": sys.version.split()[0],
+        "this_process_ms": this_process_ms,
+        "base_import_ms": base_ms,
+        "telethon_loaded_at_import": telethon_loaded,
+        "lazy_import_ms": {module: measure(module)[0] for module in HEAVY_MODULES},
+        "crypto_backends": list(crypto_backends()),
+    }
+
+def pick_account(accounts, wanted):
+    if not accounts:
+        raise RuntimeError("No accounts configured. Add one from the interactive menu first.")
+    if not wanted:
+        return accounts[0]
+    for acc in accounts:
+        if wanted in (acc['phone'], acc.get('name')):
+            return acc
+    raise RuntimeError(f"Unknown account: {wanted}")
+
+def read_text_arg(path):
+    if path == "-":
+        return sys.stdin.read()
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+json_out = sys.stdout  # Set by cli_main before stdout is redirected to stderr
+
+def emit_json(data):
+    json_out.write(json.dumps(data, ensure_ascii=False, indent=2) + "\n")
+    json_out.flush()
+
+async def cli_broadcast(forwarder, account, template, targets, message_text, message_object, delay, journal, broadcast_id,
+                        mode="copy", check=True, schedule=None, prom_file=None):
+    results = []
+    scheduler = BroadcastScheduler(min_interval=delay) if delay is not None else BroadcastScheduler()
+    skipped = []
+    health = TargetHealth()
+    if check:
+        report = await preflight(forwarder, targets, message_object, scheduler.min_interval, health=health)
+        save_refreshed(account['phone'], template, report["refreshed"])
+        for chat_id, seconds in report["slowmode"].items():
+            scheduler.set_slowmode(chat_id, seconds)
+        record_skipped(journal, broadcast_id, report["blocked"], health, account['phone'])
+        skipped = [{"chat_id": t['chat_id'], "topic_id": t.get('topic_id'), "chat_title": t.get('chat_title'), "reason": reason}
+                   for t, reason in report["blocked"]]
+        print(f"Pre-flight: {len(report['ok'])} ready, {len(skipped)} skipped, ETA ~{format_duration(report['eta'])}")
+        targets = report["ok"]
+
+    def on_result(t, result, error):
+        results.append({
+            "chat_id": t['chat_id'], "topic_id": t.get('topic_id'), "chat_title": t.get('chat_title'),
+            "status": ("scheduled" if schedule else "sent") if result else "failed", "message_ids": sent_message_ids(result),
+            "error": f"{type(error).__name__}: {error}" if error and not result else None,
+        })
+
+    stats = await run_broadcast(forwarder, targets, message_text=message_text, message_object=message_object,
+                                scheduler=scheduler, journal=journal, broadcast_id=broadcast_id, on_result=on_result, mode=mode,
+                                health=health, schedule=schedule, prom_file=prom_file)
+    save_refreshed(account['phone'], template, stats['changed_targets'])
+    summary = {k: v for k, v in stats.items() if k != 'changed_targets'}
+    print(metrics_line(stats['metrics']))
+    emit_json({"broadcast_id": broadcast_id, "template": template, "total": len(targets) + len(skipped),
+               "schedule_at": schedule.timestamp() if schedule else None, **summary,
+               "skipped": skipped, "results": results})
+    if stats['failed'] == 0 and not skipped:
+        return EXIT_OK
+    return EXIT_ALL_FAILED if stats['sent'] == 0 else EXIT_PARTIAL
+
+async def run_cli(args):
+    account = pick_account(load_accounts(), args.account)
+    phone = account['phone']
+
+    if args.command == "templates" and args.templates_command in ("list", "export"):
+        store = open_template_store(phone)
+        if args.templates_command == "list":
+            emit_json([{"name": name, "targets": count} for name, count in store.list_templates(phone)])
+            return EXIT_OK
+        names = [args.template] if args.template else [name for name, _ in store.list_templates(phone)]
+        missing = [n for n in names if not store.exists(phone, n)]
+        if missing:
+            raise RuntimeError(f"Unknown template: {missing[0]}")
+        data = {phone: {name: store.get_targets(phone, name) for name in names}}
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+        else:
+            emit_json(data)
+        return EXIT_OK
+
+    if args.command == "templates" and args.json:
+        with open(args.json, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        templates = data.get(phone, data)  # Accept both the per-phone export and a bare {name: [...]}
+        store = open_template_store(phone)
+        report = {}
+        for name, targets in templates.items():
+            if args.template and name != args.template: continue
+            report[name] = {"added": store.add_targets(phone, name, targets), "total": len(targets)}
+        emit_json(report)
+        return EXIT_OK
+
+    if args.command == "health":
+        health = TargetHealth()
+        if args.prune:
+            quarantined, removed = prune_quarantined(phone, health)
+            emit_json({"pruned": quarantined, "template_entries_removed": removed})
+        elif args.release:
+            released = len(health.quarantined(phone))
+            health.release(phone)
+            emit_json({"released": released})
+        else:
+            emit_json(health.report(phone))
+        return EXIT_OK
+
+    if args.command == "dialogs" and args.dialogs_command == "search":
+        emit_json(DialogIndex().search(phone, " ".join(args.query), limit=args.limit))
+        return EXIT_OK
+
+    schedule = parse_schedule(args.schedule) if getattr(args, 'schedule', None) else None
+    when = parse_schedule(args.at) if getattr(args, 'at', None) else None
+
+    print(f"Crypto backend: {select_crypto_backend()}")
+    forwarder = TelegramForwarder(account['api_id'], account['api_hash'], phone, interactive=False)
+    try:
+        await forwarder.session.ensure_ready()
+
+        if args.command == "scheduled":
+            journal = BroadcastJournal()
+            runs = journal.scheduled(phone, getattr(args, 'template', None))
+            if args.scheduled_command != "list":
+                runs = [r for r in runs if r["id"] == args.broadcast_id]
+                if not runs:
+                    raise RuntimeError(f"No scheduled messages left for broadcast: {args.broadcast_id}")
+            for run in runs:
+                await sync_scheduled(forwarder, journal, run)
+            runs = [r for r in runs if r["pending"]]
+            if args.scheduled_command == "list":
+                emit_json([{"broadcast_id": r["id"], "template": r["template"],
+                            "schedule_at": r["source"].get("schedule_at"), "queued_targets": len(r["pending"])} for r in runs])
+            elif not runs:
+                emit_json({"broadcast_id": args.broadcast_id, "queued_targets": 0})
+            elif args.scheduled_command == "reschedule":
+                moved = await reschedule_broadcast(forwarder, journal, runs[0], when)
+                emit_json({"broadcast_id": args.broadcast_id, "schedule_at": when.timestamp(), "messages_moved": moved})
+            else:
+                cancelled = await cancel_scheduled(forwarder, journal, runs[0])
+                emit_json({"broadcast_id": args.broadcast_id, "cancelled_targets": cancelled})
+            return EXIT_OK
+
+        if args.command == "dialogs":
+            emit_json(await DialogIndex().refresh(forwarder, phone, full=args.full))
+            return EXIT_OK
+
+        if args.command == "campaign":
+            journal = BroadcastJournal()
+            if args.campaign_command == "list":
+                await sync_all_scheduled(forwarder, journal, phone)
+                emit_json([{"broadcast_id": r["id"], "template": r["template"], "created_at": r["created_at"],
+                            "source": r["source"], "live_targets": r["live"], "untracked_targets": journal.untracked(r["id"])}
+                           for r in journal.campaigns(phone)])
+                return EXIT_OK
+            run = journal.get(args.broadcast_id)
+            if not run or run["account"] != phone:
+                raise RuntimeError(f"Unknown broadcast for this account: {args.broadcast_id}")
+            await _sync_if_scheduled(forwarder, journal, run)
+            if args.campaign_command == "delete":
+                live = len(journal.delivered(run["id"]))
+                retracted = await delete_broadcast(forwarder, journal, run)
+                emit_json({"broadcast_id": run["id"], "deleted_targets": retracted, "failed_targets": live - retracted,
+                           "untracked_targets": journal.untracked(run["id"])})
+                return EXIT_OK if retracted == live else EXIT_ALL_FAILED if retracted == 0 else EXIT_PARTIAL
+            text = args.text if args.text is not None else read_text_arg(args.text_file)
+            scheduler = BroadcastScheduler(min_interval=args.delay) if args.delay is not None else BroadcastScheduler()
+            stats = await edit_broadcast(forwarder, journal, run, text, scheduler)
+            emit_json({"broadcast_id": run["id"], "edited_targets": stats["sent"], "failed_targets": stats["failed"],
+                       "untracked_targets": journal.untracked(run["id"]), "flood_wait": stats["flood_wait"]})
+            if stats["failed"] == 0: return EXIT_OK
+            return EXIT_ALL_FAILED if stats["sent"] == 0 else EXIT_PARTIAL
+
+        if args.command == "templates":  # import --links
+            if not args.template:
+                raise RuntimeError("--template is required with --links")
+            lines = read_text_arg(args.links).splitlines()
+            targets, failures = await forwarder.resolve_targets_bulk(lines, concurrency=args.concurrency)
+            added = open_template_store(phone).add_targets(phone, args.template, targets) if targets else 0
+            emit_json({"template": args.template, "added": added, "duplicates": len(targets) - added,
+                       "errors": [{"line": n, "input": l, "error": r} for n, l, r in failures]})
+            if not failures: return EXIT_OK
+            return EXIT_ALL_FAILED if not targets else EXIT_PARTIAL
+
+        if args.command == "resolve":
+            results = []
+            for item in args.inputs:
+                target = await forwarder.resolve_target_from_input(item)
+                results.append({"input": item, "target": target})
+            emit_json(results)
+            resolved = sum(1 for r in results if r["target"])
+            if resolved == len(results): return EXIT_OK
+            return EXIT_ALL_FAILED if resolved == 0 else EXIT_PARTIAL
+
+        if args.command == "preflight":
+            store = open_template_store(phone)
+            if not store.exists(phone, args.template):
+                raise RuntimeError(f"Unknown template: {args.template}")
+            message_object = await forwarder.load_source(args.source_link) if args.source_link else None
+            report = await preflight(forwarder, store.get_targets(phone, args.template), message_object,
+                                     args.delay if args.delay is not None else BroadcastScheduler().min_interval,
+                                     health=TargetHealth())
+            save_refreshed(phone, args.template, report["refreshed"])
+            emit_json({"template": args.template, "ready": len(report["ok"]), "refreshed": len(report["refreshed"]), "unchecked": report["unchecked"],
+                       "eta_seconds": round(report["eta"]), "slowmode": report["slowmode"],
+                       "blocked": [{"chat_id": t['chat_id'], "topic_id": t.get('topic_id'), "chat_title": t.get('chat_title'),
+                                    "reason": reason} for t, reason in report["blocked"]]})
+            return EXIT_OK if not report["blocked"] else EXIT_PARTIAL
+
+        journal = BroadcastJournal()
+        if args.command == "resume":
+            run = journal.get(args.broadcast_id)
+            if not run or run["account"] != phone:
+                raise RuntimeError(f"Unknown broadcast for this account: {args.broadcast_id}")
+            template, source = run["template"], run["source"]
+            targets = journal.remaining(args.broadcast_id)
+            broadcast_id = args.broadcast_id
+        else:
+            store = open_template_store(phone)
+            if not store.exists(phone, args.template):
+                raise RuntimeError(f"Unknown template: {args.template}")
+            template = args.template
+            targets = store.get_targets(phone, template)
+            if args.source_link:
+                source = {"kind": "link", "link": args.source_link, "mode": args.mode}
+            else:
+                source = {"kind": "text", "text": args.text if args.text is not None else read_text_arg(args.text_file)}
+            if schedule:
+                source["schedule_at"] = schedule.timestamp()
+            broadcast_id = None
+
+        message_text, message_object = None, None
+        if source["kind"] == "text":
+            message_text = source["text"]
+        else:
+            message_object = await forwarder.load_source(source["link"])
+            if not message_object:
+                raise RuntimeError(f"Message not found: {source['link']}")
+        if broadcast_id is None:
+            broadcast_id = journal.start(phone, template, source, targets)
+        return await cli_broadcast(forwarder, account, template, targets, message_text, message_object,
+                                   args.delay, journal, broadcast_id, mode=source.get("mode", "copy"),
+                                   check=not args.no_preflight, schedule=schedule, prom_file=args.prom_file)
+    finally:
+        await forwarder.close()
+
+def cli_main(argv):
+    global json_out, quiet_console
+    args = build_arg_parser().parse_args(argv)
+    if args.command is None:
+        asyncio.run(main())
+        return EXIT_OK
+    if args.command == "startup-profile":
+        emit_json(startup_profile())
+        return EXIT_OK
+    quiet_console = not sys.stdout.isatty()  # No Rich rendering when piped; stdout carries only JSON
+    json_out = sys.stdout
+    try:
+        # Per-target chatter from the engine goes to stderr so stdout stays machine-readable
+        with contextlib.redirect_stdout(sys.stderr):
+            return asyncio.run(run_cli(args))
+    except Exception as e:
+        sys.stderr.write(json.dumps({"error": f"{type(e).__name__}: {e}"}) + "\n")
+        return EXIT_ERROR
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    sys.exit(cli_main(sys.argv[1:]))
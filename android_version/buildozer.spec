@@ -6,7 +6,7 @@ source.dir = .
 source.include_exts = py,png,jpg,kv,atlas,json,session,html,css,js
 source.include_patterns = templates/*
 version = 0.1
-requirements = python3,kivy==2.3.0,telethon,pyaes,asyncio,openssl,flask,jinja2,pyjnius
+requirements = python3,kivy==2.3.0,telethon,pyaes,asyncio,openssl,sqlite3,flask,jinja2,pyjnius
 
 orientation = portrait
 android.permissions = INTERNET,ACCESS_NETWORK_STATE
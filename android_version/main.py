@@ -1,39 +1,504 @@
 import os
 import json
+import time
+import uuid
+import queue
 import threading
 import asyncio
-from flask import Flask, render_template, request, jsonify
-from telethon import TelegramClient
+import sqlite3
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from telethon import TelegramClient, errors, types
 from kivy.app import App
 from kivy.uix.modalview import ModalView
 from kivy.clock import Clock
 
+# --- Crypto Backend ---
+# Telethon memilih cryptg -> libssl (lewat find_library) -> pyaes. Di Android find_library tidak
+# menemukan libcrypto dari resep openssl, jadi tanpa ini semua enkripsi MTProto (termasuk upload/
+# download media) berjalan di pyaes murni Python. Urutan di sini: cryptg -> openssl -> pyaes.
+#
+# Ini salinan backend di MoonTele.py (_openssl_ige, crypto_backends, use_crypto_backend). APK hanya
+# memaketkan folder android_version (source.dir = .), jadi MoonTele.py tidak bisa diimpor dari sini.
+# Perubahan di salah satunya harus ikut diterapkan di yang lain. MOONTELE_CRYPTO juga berlaku di sini.
+
+LIBCRYPTO_NAMES = ("libcrypto.so", "libcrypto.so.3", "libcrypto.so.1.1", "libcrypto1.1.so", "libcrypto3.so")
+
+def _openssl_ige():
+    # (encrypt_ige, decrypt_ige) yang memanggil AES_ige_encrypt langsung pada buffer bytes, atau None.
+    # ctypes baru diimpor di sini, saat backend dipilih, bukan saat modul dimuat.
+    import ctypes
+    import ctypes.util
+
+    class AesKey(ctypes.Structure):
+        _fields_ = [("rd_key", ctypes.c_uint32 * 60), ("rounds", ctypes.c_int)]  # AES_KEY milik OpenSSL
+
+    for name in filter(None, [ctypes.util.find_library("crypto")] + list(LIBCRYPTO_NAMES)):
+        try:
+            lib = ctypes.CDLL(name)
+            ige = lib.AES_ige_encrypt
+        except (OSError, AttributeError):
+            continue
+        ige.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+        ige.restype = None
+        for setup in (lib.AES_set_encrypt_key, lib.AES_set_decrypt_key):
+            setup.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p]
+
+        def run(data, key, iv, encrypt):
+            aes_key = AesKey()
+            (lib.AES_set_encrypt_key if encrypt else lib.AES_set_decrypt_key)(bytes(key), len(key) * 8, ctypes.byref(aes_key))
+            out = ctypes.create_string_buffer(len(data))
+            # IV diubah in-place oleh OpenSSL, jadi berikan salinannya
+            ige(bytes(data), out, len(data), ctypes.byref(aes_key), ctypes.create_string_buffer(bytes(iv), len(iv)), int(encrypt))
+            return out.raw
+
+        return (lambda data, key, iv: run(data, key, iv, True)), (lambda data, key, iv: run(data, key, iv, False))
+    return None
+
+def crypto_backends():
+    # Implementasi AES-IGE yang tersedia, tercepat lebih dulu (sama seperti crypto_backends() di CLI)
+    from telethon.crypto import aes
+    impls = {}
+    if aes.cryptg:
+        impls["cryptg"] = aes.cryptg
+    openssl = _openssl_ige()
+    if openssl:
+        impls["openssl"] = openssl
+    impls["pyaes"] = None
+    return impls
+
+def select_crypto_backend(preferred=os.environ.get("MOONTELE_CRYPTO")):
+    # Dipanggil sekali saat start, sebelum TelegramClient pertama dibuat. Memakai `preferred` jika
+    # tersedia, jika tidak backend tercepat. Mengembalikan nama backend yang aktif.
+    from telethon.crypto import aes
+    impls = crypto_backends()
+    if preferred and preferred not in impls:
+        print(f"[MoonTele] MOONTELE_CRYPTO={preferred} is not available here, using the fastest backend")
+        preferred = None
+    name = preferred or next(iter(impls))
+    aes.cryptg = impls["cryptg"] if name == "cryptg" else None
+    aes.libssl.encrypt_ige, aes.libssl.decrypt_ige = impls["openssl"] if name == "openssl" else (None, None)
+    return name
+
+CRYPTO_BACKEND = "pyaes"
+
 # --- Flask Backend ---
 server = Flask(__name__)
 DATA_DIR = ""
 
+# --- Shared State (accounts & templates) ---
+# Isi file JSON disimpan di memori dan hanya dibaca ulang jika mtime/ukuran file berubah.
+# ETag diturunkan dari mtime+ukuran, jadi polling tanpa perubahan cukup dijawab 304.
+
+class FileState:
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+        self.data = default
+        self.key = None
+        self.etag = f"{name}-empty"
+        self.lock = threading.Lock()
+
+    def stat(self):
+        # Kunci versi isi file, atau None jika file tidak ada
+        try:
+            st = os.stat(os.path.join(DATA_DIR, self.name))
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def read(self, key):
+        with open(os.path.join(DATA_DIR, self.name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def get(self):
+        key = self.stat()
+        with self.lock:
+            if key != self.key:
+                self.data = self.default if key is None else self.read(key)
+                self.key = key
+                self.etag = f"{self.name}-" + "-".join(map(str, key)) if key else f"{self.name}-empty"
+            return self.data, self.etag
+
+class TemplateState(FileState):
+    # CLI memindahkan target_templates.json ke moontele.db (file lama diganti nama jadi .migrated).
+    # Selama JSON masih ada, JSON yang dipakai; setelah itu template dibaca langsung dari SQLite.
+    # Penulisan SQLite (WAL) masuk ke file -wal dulu, jadi kunci versinya ikut memakai file -wal.
+    DB_NAME = "moontele.db"
+
+    def __init__(self):
+        super().__init__("target_templates.json", {})
+
+    def stat(self):
+        key = super().stat()
+        if key is not None:
+            return ("json",) + key
+        db = os.path.join(DATA_DIR, self.DB_NAME)
+        parts = []
+        for path in (db, db + "-wal"):
+            try:
+                st = os.stat(path)
+                parts += [st.st_mtime_ns, st.st_size]
+            except OSError:
+                parts += [0, 0]
+        return ("db",) + tuple(parts) if parts[1] else None
+
+    def read(self, key):
+        if key[0] == "json":
+            return super().read(key)
+        data = {}
+        conn = sqlite3.connect(f"file:{os.path.join(DATA_DIR, self.DB_NAME)}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("""
+                SELECT t.account, t.name, tt.data FROM templates t
+                LEFT JOIN template_targets tt ON tt.template_id = t.id
+                ORDER BY t.id, tt.position""").fetchall()
+        except sqlite3.OperationalError:
+            rows = []  # Database belum punya tabel template
+        finally:
+            conn.close()
+        for account, name, target in rows:
+            targets = data.setdefault(account, {}).setdefault(name, [])
+            if target is not None:
+                targets.append(json.loads(target))
+        return data
+
+accounts_state = FileState("accounts.json", [])
+templates_state = TemplateState()
+
+def account_templates(phone):
+    data, etag = templates_state.get()
+    if data and isinstance(next(iter(data.values())), list):
+        return data, etag  # Format lama (flat), belum per akun
+    return data.get(phone, {}), etag
+
+def cached_json(etag, build):
+    # 304 jika klien sudah punya versi ini; build() hanya dipanggil jika perlu
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        resp = jsonify(build())
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+def paginate(items):
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(500, max(1, int(request.args.get('per_page', 50))))
+    except ValueError:
+        page, per_page = 1, 50
+    total = len(items)
+    start = (page - 1) * per_page
+    return {"items": items[start:start + per_page], "page": page, "per_page": per_page,
+            "total": total, "pages": (total + per_page - 1) // per_page, "status": "ok"}
+
 @server.route('/')
 def index():
     return render_template('index.html')
 
 @server.route('/api/get_data', methods=['POST', 'GET'])
 def get_data():
-    acc_path = os.path.join(DATA_DIR, "accounts.json")
-    accounts = []
-    if os.path.exists(acc_path):
-        with open(acc_path, 'r') as f:
-            accounts = json.load(f)
-    return jsonify({"accounts": accounts, "status": "ok"})
+    accounts, etag = accounts_state.get()
+    return cached_json(etag, lambda: {"accounts": accounts, "crypto": CRYPTO_BACKEND, "status": "ok"})
+
+@server.route('/api/templates', methods=['GET'])
+def list_templates():
+    templates, etag = account_templates(request.args.get('account', ''))
+    q = request.args.get('q', '').lower()
+
+    def build():
+        items = [{"name": name, "targets": len(targets)} for name, targets in templates.items() if q in name.lower()]
+        return paginate(items)
+    return cached_json(etag, build)
+
+@server.route('/api/templates/<name>/targets', methods=['GET'])
+def template_targets(name):
+    templates, etag = account_templates(request.args.get('account', ''))
+    if name not in templates:
+        return jsonify({"status": "error", "error": "unknown template"}), 404
+    q = request.args.get('q', '').lower()
+
+    def build():
+        items = [t for t in templates[name]
+                 if not q or q in str(t.get('chat_title', '')).lower() or q in str(t.get('topic_title') or '').lower()]
+        return paginate(items)
+    return cached_json(etag, build)
 
 @server.route('/api/broadcast', methods=['POST'])
 def broadcast():
-    data = request.json
-    # Di sini kita akan memanggil fungsi Telethon
-    # Untuk contoh ini kita kembalikan sukses dulu
-    return jsonify({"status": f"Broadcast started for {data['acc']}"})
+    data = request.json or {}
+    if not data.get('acc') or not data.get('tpl') or not data.get('msg'):
+        return jsonify({"status": "error", "error": "acc, tpl and msg are required"}), 400
+    delay = data.get('delay')
+    try:
+        delay = 5.0 if delay in (None, "") else float(delay)
+    except (TypeError, ValueError):
+        delay = -1.0
+    if not 0 <= delay < float("inf"):
+        return jsonify({"status": "error", "error": "delay must be a non-negative number of seconds"}), 400
+    # Hanya masuk antrian; pengiriman berjalan di thread engine, request tidak menunggu Telegram
+    job_id = engine.submit(data['acc'], data['tpl'], data['msg'], delay)
+    return jsonify({"status": "queued", "job_id": job_id}), 202
+
+@server.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({"jobs": engine.list_jobs(), "status": "ok"})
+
+@server.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = engine.get_job(job_id)
+    if not job:
+        return jsonify({"status": "error", "error": "unknown job"}), 404
+    return jsonify(job)
+
+@server.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if not engine.cancel(job_id):
+        return jsonify({"status": "error", "error": "unknown or finished job"}), 404
+    return jsonify({"status": "cancelling", "job_id": job_id})
+
+@server.route('/api/events')
+def events():
+    # Server-Sent Events: hasil per target & perubahan status job dikirim saat terjadi.
+    # Saat idle thread ini hanya menunggu di queue (tanpa polling / baca file).
+    subscriber = engine.subscribe()
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            for job in engine.list_jobs():
+                yield f"data: {json.dumps({'type': 'job', 'job': job})}\n\n"
+            while True:
+                try:
+                    event = subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            engine.unsubscribe(subscriber)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 def run_server():
-    server.run(host='127.0.0.1', port=5000)
+    server.run(host='127.0.0.1', port=5000, threaded=True)
+
+# --- Telegram Job Engine ---
+# Satu event loop asyncio yang hidup terus di thread sendiri. Loop ini memegang TelegramClient
+# per akun (tetap terkoneksi) dan menjalankan job broadcast yang dikirim dari route Flask.
+
+def target_peer(target):
+    # InputPeer dari peer_type/access_hash yang disimpan CLI di template (tanpa RPC lookup)
+    kind, chat_id, access_hash = target.get('peer_type'), target['chat_id'], target.get('access_hash')
+    if kind == "channel" and access_hash is not None:
+        return types.InputPeerChannel(chat_id, access_hash)
+    if kind == "chat":
+        return types.InputPeerChat(chat_id)
+    if kind == "user" and access_hash is not None:
+        return types.InputPeerUser(chat_id, access_hash)
+    return chat_id
+
+def parse_message_link(link):
+    # (chat, msg_id) dari link t.me, atau None jika msg berupa teks biasa
+    clean = link.strip().replace("https://", "").replace("http://", "")
+    if not clean.startswith("t.me/") or " " in clean:
+        return None
+    parts = [p for p in clean[len("t.me/"):].split("?")[0].split("/") if p]
+    try:
+        if parts[0] == "c" and len(parts) >= 3:
+            return int(f"-100{parts[1]}"), int(parts[-1])
+        if len(parts) >= 2:
+            return parts[0], int(parts[-1])
+    except ValueError:
+        pass
+    return None
+
+FLOOD_MAX_RETRIES = 3   # FloodWait per target sebelum target dianggap gagal
+FLOOD_MAX_WAIT = 900    # FloodWait lebih lama dari ini menggagalkan target, bukan menahan job
+
+async def send_paced(client, target, message):
+    # Kirim ke satu target; FloodWait ditunggu lalu diulang dengan aturan yang sama untuk setiap percobaan
+    for attempt in range(FLOOD_MAX_RETRIES + 1):
+        try:
+            return await client.send_message(target_peer(target), message, reply_to=target.get('topic_id'))
+        except errors.FloodWaitError as e:
+            if attempt == FLOOD_MAX_RETRIES or e.seconds > FLOOD_MAX_WAIT:
+                raise
+            await asyncio.sleep(e.seconds)
+
+class JobEngine:
+    def __init__(self):
+        self.loop = None
+        self.queue = None
+        self.clients = {}        # phone -> connected, authorized TelegramClient
+        self.account_locks = {}  # phone -> asyncio.Lock, satu job per akun dalam satu waktu
+        self.jobs = {}           # job_id -> job dict (dibaca thread Flask lewat self.lock)
+        self.tasks = {}          # job_id -> asyncio.Task
+        self.subscribers = []    # queue.Queue per klien SSE
+        self.lock = threading.Lock()
+        self.started = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run_loop, daemon=True).start()
+        self.started.wait()
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue()
+        self.loop.create_task(self._dispatcher())
+        self.started.set()
+        self.loop.run_forever()
+
+    # -- Dipanggil dari thread Flask --
+
+    def submit(self, phone, template, message, delay):
+        job_id = uuid.uuid4().hex[:10]
+        job = {"id": job_id, "account": phone, "template": template, "delay": delay,
+               "status": "queued", "total": 0, "sent": 0, "failed": 0, "results": [],
+               "error": None, "created_at": time.time(), "finished_at": None}
+        with self.lock:
+            self.jobs[job_id] = job
+        self._publish({"type": "job", "job": self._job_summary(job)})
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (job_id, message))
+        return job_id
+
+    def get_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job, results=list(job["results"])) if job else None
+
+    def list_jobs(self):
+        with self.lock:
+            return [self._job_summary(job) for job in self.jobs.values()]
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=1000)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def _publish(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                pass  # Klien yang lambat kehilangan event lama, bukan memblokir engine
+
+    def _job_summary(self, job):
+        return {k: v for k, v in job.items() if k != "results"}
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job or job["status"] not in ("queued", "running"):
+                return False
+            job["status"] = "cancelling"
+            summary = self._job_summary(job)
+        self._publish({"type": "job", "job": summary})
+        self.loop.call_soon_threadsafe(self._cancel_task, job_id)
+        return True
+
+    # -- Berjalan di event loop engine --
+
+    def _cancel_task(self, job_id):
+        task = self.tasks.get(job_id)
+        if task:
+            task.cancel()
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+            summary = self._job_summary(self.jobs[job_id])
+        self._publish({"type": "job", "job": summary})
+
+    async def _dispatcher(self):
+        while True:
+            job_id, message = await self.queue.get()
+            task = self.loop.create_task(self._run_job(job_id, message))
+            self.tasks[job_id] = task
+            task.add_done_callback(lambda _t, j=job_id: self.tasks.pop(j, None))
+
+    async def _client(self, phone):
+        # Client per akun dipakai ulang: connect + cek login hanya sekali, bukan per job
+        client = self.clients.get(phone)
+        if client and client.is_connected():
+            return client
+        if client is None:
+            account = next((a for a in accounts_state.get()[0] if a['phone'] == phone), None)
+            if not account:
+                raise RuntimeError(f"Unknown account {phone}")
+            client = TelegramClient(os.path.join(DATA_DIR, 'session_' + phone), int(account['api_id']), account['api_hash'])
+        try:
+            await client.connect()
+            if not await client.is_user_authorized():
+                raise RuntimeError(f"Account {phone} is not logged in")
+        except Exception:
+            # Tutup file session, kalau tidak job berikutnya membuka session yang sama dua kali
+            # ("database is locked"); client berikutnya dibuat baru
+            self.clients.pop(phone, None)
+            await client.disconnect()
+            raise
+        self.clients[phone] = client
+        return client
+
+    async def _run_job(self, job_id, message):
+        with self.lock:
+            job = self.jobs[job_id]
+            cancelled = job["status"] == "cancelling"
+            phone, template, delay = job["account"], job["template"], job["delay"]
+        if cancelled:
+            self._update(job_id, status="cancelled", finished_at=time.time())
+            return
+        lock = self.account_locks.setdefault(phone, asyncio.Lock())
+        try:
+            async with lock:
+                self._update(job_id, status="running")
+                client = await self._client(phone)
+                templates, _ = account_templates(phone)
+                if template not in templates:
+                    raise RuntimeError(f"Unknown template {template}")
+                targets = templates[template]
+                self._update(job_id, total=len(targets))
+
+                source = parse_message_link(message)
+                if source:
+                    message = await client.get_messages(source[0], ids=source[1])
+                    if not message:
+                        raise RuntimeError("Source message not found")
+
+                # Jeda diukur dari awal pengiriman sebelumnya dan hanya berlaku setelah pesan benar-benar terkirim
+                next_send = 0.0
+                for t in targets:
+                    result = {"chat_id": t['chat_id'], "topic_id": t.get('topic_id'), "chat_title": t.get('chat_title')}
+                    await asyncio.sleep(max(0.0, next_send - self.loop.time()))
+                    started = self.loop.time()
+                    try:
+                        await send_paced(client, t, message)
+                        result["status"] = "sent"
+                        next_send = started + delay
+                    except Exception as e:
+                        result.update(status="failed", error=f"{type(e).__name__}: {e}")
+                    with self.lock:
+                        job["results"].append(result)
+                        job["sent" if result["status"] == "sent" else "failed"] += 1
+                        progress = {"sent": job["sent"], "failed": job["failed"], "total": job["total"]}
+                    self._publish({"type": "result", "job_id": job_id, "result": result, **progress})
+                self._update(job_id, status="done", finished_at=time.time())
+        except asyncio.CancelledError:
+            self._update(job_id, status="cancelled", finished_at=time.time())
+        except Exception as e:
+            self._update(job_id, status="error", error=f"{type(e).__name__}: {e}", finished_at=time.time())
+
+engine = JobEngine()
 
 # --- Kivy WebView Wrapper ---
 # Kita gunakan Kivy hanya sebagai "bingkai" untuk membuka browser (WebView)
@@ -57,7 +522,12 @@ class HybridApp(App):
         global DATA_DIR
         DATA_DIR = self.data_dir
         
-        # Jalankan Flask di Thread terpisah
+        global CRYPTO_BACKEND
+        CRYPTO_BACKEND = select_crypto_backend()
+        print(f"[MoonTele] Crypto backend: {CRYPTO_BACKEND}")
+
+        # Engine Telegram (event loop sendiri) lalu Flask di Thread terpisah
+        engine.start()
         threading.Thread(target=run_server, daemon=True).start()
         
         layout = BoxLayout()
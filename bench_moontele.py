@@ -0,0 +1,324 @@
+"""
+Offline benchmarks for MoonTele's hot paths, run against an in-process fake Telegram client.
+
+    python3 bench_moontele.py                          # every scenario
+    python3 bench_moontele.py broadcast --latency 20   # one scenario, 20 ms per request
+    python3 bench_moontele.py --save before.json       # keep the results...
+    python3 bench_moontele.py --compare before.json    # ...and compare a later run against them
+    python3 bench_moontele.py crypto                   # encryption throughput per crypto backend
+    python3 bench_moontele.py menu                     # the menu broadcast with its progress bar, end to end
+
+Nothing touches the network or your data: each scenario runs in its own temporary directory.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import io
+import statistics
+
+import MoonTele as M
+from telethon import errors, functions, types
+
+# --- Fake Telegram ---
+
+BASE_ID = 1_000_000  # Channel ids are BASE_ID + n, usernames are grp<n>
+
+class FakeTelegram:
+    """
+    Stand-in for TelegramClient. Every request goes through _call (so BroadcastMetrics sees it),
+    which sleeps for the simulated latency and may answer with a FloodWait. Chats are
+    generated on demand: every `forum_every`-th one is a forum, and a `fail_rate` share of
+    them reject writes with ChatWriteForbidden. All randomness is seeded.
+    """
+    def __init__(self, latency=0.005, jitter=0.3, flood_rate=0.0, flood_seconds=1, fail_rate=0.0, forum_every=5, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.fail_rate = fail_rate
+        self.forum_every = forum_every
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.flood_sleep_threshold = 60
+        self.connected = False
+        self.next_id = 1
+        self.requests = 0
+
+    # Session
+    def is_connected(self): return self.connected
+    async def connect(self): self.connected = True
+    async def disconnect(self): self.connected = False
+    async def is_user_authorized(self): return True
+    async def get_me(self): return types.User(id=1, first_name="Bench", username="bench")
+
+    # Model
+    def _channel(self, n):
+        return types.Channel(id=BASE_ID + n, title=f"Group {n}", photo=types.ChatPhotoEmpty(), date=None,
+                             access_hash=n * 7 + 1, username=f"grp{n}", megagroup=True, forum=n % self.forum_every == 0)
+
+    def _dead(self, chat_id):
+        return random.Random(self.seed * 1_000_003 + chat_id).random() < self.fail_rate
+
+    def _message(self, n, msg_id):
+        reply_to = None
+        if n % self.forum_every == 0:
+            topic = msg_id - msg_id % 50 + 1
+            reply_to = types.MessageReplyHeader(reply_to_msg_id=topic, forum_topic=True)
+        return types.Message(id=msg_id, peer_id=types.PeerChannel(BASE_ID + n), date=None, message="m", reply_to=reply_to)
+
+    # Transport
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        self.requests += 1
+        await asyncio.sleep(max(0.0, self.latency * (1 + self.rng.uniform(-self.jitter, self.jitter))))
+        name = type(request).__name__
+        if name in ("SendMessageRequest", "ForwardMessagesRequest") and self.rng.random() < self.flood_rate:
+            raise errors.FloodWaitError(request, capture=self.flood_seconds)
+        return getattr(self, "_" + name)(request)
+
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        return await self._call(None, request, ordered, flood_sleep_threshold)
+
+    def _ResolveUsernameRequest(self, r):
+        n = int(r.username[3:])
+        return types.contacts.ResolvedPeer(peer=types.PeerChannel(BASE_ID + n), chats=[self._channel(n)], users=[])
+
+    def _GetChannelsRequest(self, r):
+        return types.messages.Chats(chats=[self._channel(c.channel_id - BASE_ID) for c in r.id])
+
+    def _GetUsersRequest(self, r):
+        return [types.User(id=u.user_id, first_name="User", last_name=str(u.user_id), access_hash=u.user_id * 3) for u in r.id]
+
+    def _GetMessagesRequest(self, r):
+        n = r.channel.channel_id - BASE_ID
+        return [self._message(n, i.id) for i in r.id]
+
+    def _GetForumTopicsByIDRequest(self, r):
+        topics = [types.ForumTopic(id=t, date=None, peer=types.PeerChannel(r.peer.channel_id), title=f"Topic {t}", icon_color=0,
+                                   top_message=t, read_inbox_max_id=0, read_outbox_max_id=0, unread_count=0,
+                                   unread_mentions_count=0, unread_reactions_count=0, unread_poll_votes_count=0,
+                                   from_id=types.PeerUser(1), notify_settings=types.PeerNotifySettings()) for t in r.topics]
+        return types.messages.ForumTopics(count=len(topics), topics=topics, messages=[], chats=[], users=[], pts=0)
+
+    def _SendMessageRequest(self, r):
+        chat_id = getattr(r.peer, 'channel_id', None) or getattr(r.peer, 'user_id', None) or getattr(r.peer, 'chat_id', 0)
+        if self._dead(chat_id):
+            raise errors.ChatWriteForbiddenError(r)
+        self.next_id += 1
+        return types.Message(id=self.next_id, peer_id=types.PeerChannel(chat_id), date=None, message=r.message)
+
+    # High-level client API used by MoonTele
+    async def get_entity(self, chat):
+        if isinstance(chat, str):
+            result = await self._call(None, functions.contacts.ResolveUsernameRequest(chat.lstrip("@")))
+            return result.chats[0]
+        if chat < 0:
+            channel_id = int(str(chat)[4:]) if str(chat).startswith("-100") else -chat
+            result = await self._call(None, functions.channels.GetChannelsRequest([types.InputChannel(channel_id, 0)]))
+            return result.chats[0]
+        return (await self._call(None, functions.users.GetUsersRequest([types.InputUser(chat, 0)])))[0]
+
+    async def get_input_entity(self, chat):
+        return M.input_peer_from_dict(M.peer_to_dict(await self.get_entity(chat)))
+
+    async def get_messages(self, peer, ids=None):
+        single = not isinstance(ids, list)
+        channel = types.InputChannel(peer.channel_id, peer.access_hash)
+        request = functions.channels.GetMessagesRequest(channel, [types.InputMessageID(i) for i in ([ids] if single else ids)])
+        messages = await self._call(None, request)
+        return messages[0] if single else messages
+
+    async def send_message(self, peer, message, reply_to=None, schedule=None, **kwargs):
+        return await self._call(None, functions.messages.SendMessageRequest(
+            peer=peer, message=str(message), reply_to=types.InputReplyToMessage(reply_to) if reply_to else None,
+            schedule_date=schedule))
+
+# --- Scenarios ---
+
+def make_forwarder(fake):
+    forwarder = M.TelegramForwarder(1, "bench", "+0", interactive=False)
+    forwarder.client = fake
+    return forwarder
+
+def channel_target(fake, n, topic_id=None):
+    entry = M.peer_to_dict(fake._channel(n))
+    return {"chat_id": entry["id"], "chat_title": entry["title"], "topic_id": topic_id, "topic_title": None,
+            "type": "Group/Channel", "peer_type": "channel", "access_hash": entry["access_hash"]}
+
+async def bench_broadcast(fake, size):
+    """One text message to `size` targets (every forum chat via a topic), journaled, no pacing."""
+    forwarder = make_forwarder(fake)
+    targets = [channel_target(fake, n, topic_id=1 if n % fake.forum_every == 0 else None) for n in range(1, size + 1)]
+    journal = M.BroadcastJournal()
+    broadcast_id = journal.start("+0", "bench", {"kind": "text", "text": "bench"}, targets)
+    t0 = time.perf_counter()
+    stats = await M.run_broadcast(forwarder, targets, message_text="bench", scheduler=M.BroadcastScheduler(min_interval=0),
+                                  journal=journal, broadcast_id=broadcast_id, prom_file=None)
+    seconds = time.perf_counter() - t0
+    metrics = stats["metrics"]
+    return {"targets": size, "seconds": seconds, "targets_per_sec": size / seconds, "sent": stats["sent"],
+            "failed": stats["failed"], "deferred": stats["deferred"], "flood_wait": stats["flood_wait"],
+            "rpc": sum(metrics["rpc"].values()), "p50_ms": metrics["latency"]["p50"] * 1000,
+            "p95_ms": metrics["latency"]["p95"] * 1000}
+
+async def bench_menu_broadcast(fake, size):
+    """The menu's broadcast path end to end: broadcast_with_progress with its Rich progress bar and summary."""
+    forwarder = make_forwarder(fake)
+    targets = [channel_target(fake, n) for n in range(1, size + 1)]
+    journal = M.BroadcastJournal()
+    broadcast_id = journal.start("+0", "bench", {"kind": "text", "text": "bench"}, targets)
+    t0 = time.perf_counter()
+    stats = await M.broadcast_with_progress(forwarder, targets, M.BroadcastScheduler(min_interval=0), journal, broadcast_id,
+                                            message_text="bench")
+    seconds = time.perf_counter() - t0
+    journaled = len(journal.delivered(broadcast_id))
+    assert journaled == stats["sent"] and stats["sent"] + stats["failed"] == size, (journaled, stats)
+    return {"targets": size, "seconds": seconds, "targets_per_sec": size / seconds, "sent": stats["sent"],
+            "failed": stats["failed"], "journaled": journaled}
+
+async def bench_import(fake, size):
+    """Bulk import of `size` lines: public, private-with-topic and user-id inputs, several per chat."""
+    rng = random.Random(fake.seed)
+    chats = max(1, size // 3)
+    lines = []
+    for i in range(size):
+        n = rng.randint(1, chats)
+        kind = rng.random()
+        if kind < 0.45:
+            lines.append(f"https://t.me/grp{n}/{rng.randint(2, 5000)}")
+        elif kind < 0.8:
+            topic = rng.randint(1, 20) * 50 + 1
+            lines.append(f"https://t.me/c/{BASE_ID + n}/{topic}/{topic + rng.randint(1, 40)}")
+        else:
+            lines.append(str(5_000_000 + n))
+    forwarder = make_forwarder(fake)
+    t0 = time.perf_counter()
+    targets, failures = await forwarder.resolve_targets_bulk(lines, concurrency=8)
+    added = M.open_template_store("+0").add_targets("+0", "bench", targets)
+    seconds = time.perf_counter() - t0
+    return {"lines": size, "seconds": seconds, "lines_per_sec": size / seconds, "added": added,
+            "errors": len(failures), "rpc": fake.requests}
+
+async def bench_templates(fake, size, cycles=5):
+    """save_templates / load_templates round trips of one account holding `size` targets in 10 templates."""
+    per_template = max(1, size // 10)
+    data = {f"T{k}": [channel_target(fake, k * per_template + i, topic_id=i % 3 or None) for i in range(per_template)]
+            for k in range(10)}
+    M.open_template_store("+0")  # Schema + legacy migration outside the timed part
+    save_times, load_times = [], []
+    for _ in range(cycles):
+        t0 = time.perf_counter()
+        M.save_templates(data, "+0")
+        save_times.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        loaded = M.load_templates("+0")
+        load_times.append(time.perf_counter() - t0)
+    assert sum(len(v) for v in loaded.values()) == per_template * 10
+    return {"targets": per_template * 10, "cycles": cycles, "seconds": sum(save_times) + sum(load_times),
+            "save_ms": statistics.median(save_times) * 1000, "load_ms": statistics.median(load_times) * 1000}
+
+async def bench_crypto(fake, size, min_seconds=0.5):
+    """
+    MTProto AES-IGE throughput of every crypto backend available here, on `size` KiB payloads
+    (512 KiB is one upload part). Upload = encrypt, download = decrypt, in MB/s.
+    """
+    from telethon.crypto.aes import AES
+    payload, key, iv = os.urandom(size * 1024), os.urandom(32), os.urandom(32)
+    active = M.select_crypto_backend()
+    result = {"payload_kib": size, "active": active}
+    t_start = time.perf_counter()
+    try:
+        for name in M.crypto_backends():
+            M.use_crypto_backend(name)
+            for direction, func, data in (("up", AES.encrypt_ige, payload), ("down", AES.decrypt_ige, AES.encrypt_ige(payload, key, iv))):
+                rounds, t0 = 0, time.perf_counter()
+                while not rounds or time.perf_counter() - t0 < min_seconds:
+                    func(data, key, iv)
+                    rounds += 1
+                result[f"{name}_{direction}_mbps"] = rounds * len(payload) / (time.perf_counter() - t0) / 1024 ** 2
+    finally:
+        M.use_crypto_backend(active)
+    result["speedup"] = result[f"{active}_up_mbps"] / result["pyaes_up_mbps"]
+    result["seconds"] = time.perf_counter() - t_start
+    return result
+
+SCENARIOS = {
+    "broadcast": (bench_broadcast, 1000),
+    "menu": (bench_menu_broadcast, 100),
+    "import": (bench_import, 300),
+    "templates": (bench_templates, 10000),
+    "crypto": (bench_crypto, 512),
+}
+
+# --- Runner ---
+
+def run_scenario(name, args, seed):
+    func, default_size = SCENARIOS[name]
+    fake = FakeTelegram(latency=args.latency / 1000, flood_rate=args.flood_rate, fail_rate=args.fail_rate, seed=seed)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="moontele-bench-") as tmp:
+        os.chdir(tmp)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):  # Per-target ✅ / ❌ lines
+                return asyncio.run(func(fake, args.size or default_size))
+        finally:
+            os.chdir(cwd)
+
+def median_results(runs):
+    return {k: statistics.median(r[k] for r in runs) if isinstance(runs[0][k], (int, float)) else runs[0][k] for k in runs[0]}
+
+def format_result(result):
+    return "  ".join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}" for k, v in result.items())
+
+def compare(current, previous):
+    """Lines showing how `seconds` and throughput moved against a saved run."""
+    lines = []
+    for name, result in current.items():
+        before = previous.get("results", {}).get(name)
+        if not before: continue
+        keys = ["seconds", "targets_per_sec", "lines_per_sec", "save_ms", "load_ms"] + [k for k in result if k.endswith("_mbps")]
+        for key in keys:
+            if key in result and before.get(key):
+                change = (result[key] - before[key]) / before[key] * 100
+                lines.append(f"{name:<10} {key:<16} {before[key]:>10.2f} → {result[key]:>10.2f}  ({change:+.1f}%)")
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline MoonTele benchmarks (fake Telegram client)")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"Any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--size", type=int, help="Override the scenario size (targets / lines / KiB for crypto)")
+    parser.add_argument("--latency", type=float, default=5.0, help="Simulated ms per request (default 5)")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="Share of sends answered with a 1s FloodWait")
+    parser.add_argument("--fail-rate", type=float, default=0.02, help="Share of chats that reject writes")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scenario; the median is reported")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", metavar="FILE", help="Write the results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="Compare against results saved with --save")
+    args = parser.parse_args(argv)
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario: {unknown[0]}")
+
+    M.quiet_console = True
+    results = {}
+    for name in args.scenarios or list(SCENARIOS):
+        results[name] = median_results([run_scenario(name, args, args.seed + i) for i in range(args.repeat)])
+        print(f"{name:<10} {format_result(results[name])}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print("\n" + "\n".join(compare(results, json.load(f)) or ["Nothing to compare."]))
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({"version": M.__version__, "python": sys.version.split()[0], "created_at": time.time(),
+                       "settings": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+                       "results": results}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())